@@ -1,4 +1,3 @@
-import machine
 import sys
 
 from lib.monitor import MonitorDevice
@@ -14,4 +13,6 @@ except OSError as e:
     print('Fatal error:', e)
     sys.print_exception(e)
 
-    machine.reset()
+    from lib.recovery import recovery
+
+    recovery.reset('fatal', e)
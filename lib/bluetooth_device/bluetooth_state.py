@@ -1,12 +1,17 @@
 import bluetooth
-import gc
-import machine
 import requests
 import sys
 import utime
 
 from lib.config import Config
-from lib.logger import Logger
+from lib.gc_policy import gc_policy
+from lib.heap import heap
+from lib.logger import Logger, hex_dump
+from lib.phases import PHASE_CONNECT, PHASE_DISCOVER, PHASE_PARSE, PHASE_UPLOAD
+from lib.rtc_state import rtc_state
+from lib.time_sync import time_sync
+from lib.trace import trace
+from lib.recovery import recovery, SUBSYSTEM_BLUETOOTH, SUBSYSTEM_HTTP
 from lib.bluetooth_device.bluetooth_device import BluetoothDevice
 import lib.bluetooth_device.const as const
 from lib.bluetooth_device.data_parser import DataParser
@@ -35,6 +40,9 @@ class BluetoothState:
     api_token: str = ''
     state_mapping: dict[str, callable] = {}
     is_started: bool = False
+    used_handle_hints: bool = False
+    handle_hints_changed: bool = False
+    phase_started: int = 0
     debug: bool = False
     logger: Logger
 
@@ -44,6 +52,8 @@ class BluetoothState:
         }
 
         self.is_started = False
+        self.used_handle_hints = False
+        self.handle_hints_changed = False
         self.debug = config.debug
         self.logger = logger
 
@@ -63,7 +73,7 @@ class BluetoothState:
 
         utime.sleep_ms(100)
 
-        gc.collect()
+        gc_policy.between_phases()
 
         utime.sleep_ms(100)
 
@@ -83,6 +93,35 @@ class BluetoothState:
 
         self.logger.output('Bluetooth initialized.')
 
+    def apply_config(self, config: Config):
+        self.debug = config.debug
+        self.only_devices = config.bluetooth_devices
+        self.api_url = config.api_url
+        self.api_endpoint = config.battery_endpoint
+        self.api_token = config.api_token
+
+    def reinitialize(self, attempt: int = 1):
+        self.logger.output('Reinitializing Bluetooth stack...')
+
+        try:
+            self.bt.active(False)
+
+        except OSError:
+            pass
+
+        utime.sleep_ms(100)
+
+        self.is_started = False
+        self.current_device = None
+        self.conn_handle = None
+        self.services_range = None
+        self.devices = []
+        self.state = STATE_DISCONNECTED
+
+        self.bt = bluetooth.BLE()
+        self.bt.irq(self.bt_irq)
+        self.bt.active(True)
+
     def start(self):
         if self.is_started:
             return
@@ -112,6 +151,10 @@ class BluetoothState:
             utime.sleep_ms(1000)
 
         self.current_device = BluetoothDevice(address)
+
+        heap.begin(PHASE_CONNECT)
+        self.phase_started = trace.begin()
+
         self.set_state(STATE_CONNECTING)
         self.bt.gap_connect(0, bytes(int(b, 16) for b in address.split(':')))
 
@@ -119,8 +162,61 @@ class BluetoothState:
         self.logger.output('Connected to device.')
         self.conn_handle = data[0]
 
+        heap.end(PHASE_CONNECT)
+        trace.end(PHASE_CONNECT, self.phase_started, trace.device(self.current_device.address))
+
+        # Handles found on an earlier connection skip service discovery, they are kept in RTC memory across resets
+        hints = rtc_state.get('gatt_handles', {}).get(self.current_device.address)
+        self.used_handle_hints = hints is not None
+
+        if self.used_handle_hints:
+            self.current_device.set_notify_handle(hints[0])
+            self.current_device.set_write_handle(hints[1])
+            self.current_device.set_cccd_handle(hints[2])
+
+            self.set_state(STATE_READY)
+
+            return
+
+        heap.begin(PHASE_DISCOVER)
+        self.phase_started = trace.begin()
+
         self.get_services()
 
+    def remember_handles(self):
+        device = self.current_device
+        hints = rtc_state.get('gatt_handles', {})
+
+        handles = [device.notify_handle, device.write_handle, device.cccd_handle]
+        if hints.get(device.address) == handles:
+            return
+
+        hints[device.address] = handles
+
+        rtc_state.set('gatt_handles', hints)
+
+        self.handle_hints_changed = True
+
+    def forget_handles(self, address: str):
+        hints = rtc_state.get('gatt_handles', {})
+        if address not in hints:
+            return
+
+        self.logger.output(f'Handles of {address} did not work, discovering services next time.')
+
+        del hints[address]
+
+        rtc_state.set('gatt_handles', hints)
+
+        self.handle_hints_changed = True
+
+    def save_handle_hints(self):
+        # Not written from the IRQ handlers, which only update the hints in memory
+        if self.handle_hints_changed:
+            self.handle_hints_changed = False
+
+            rtc_state.save()
+
     def disconnect(self):
         if not self.current_device:
             self.set_state(STATE_DISCONNECTED)
@@ -134,9 +230,9 @@ class BluetoothState:
 
             except OSError as e:
                 if str(e) != '-128': # Ignore "already disconnected" error
-                    self.logger.output('OSError during disconnect:', str(e))
+                    self.logger.warning('OSError during disconnect: %s', e)
 
-                    machine.reset()
+                    recovery.failure(SUBSYSTEM_BLUETOOTH, e)
 
             except Exception as e:
                 self.logger.output(f'Error during disconnect: {e}')
@@ -149,7 +245,7 @@ class BluetoothState:
 
         self.set_state(STATE_DISCONNECTED)
 
-        gc.collect()
+        gc_policy.between_phases()
 
     def get_services(self):
         if self.current_device:
@@ -167,11 +263,11 @@ class BluetoothState:
                 self.logger.output('No services found to get descriptors from')
 
     def set_state(self, state: str, data: tuple | None = None):
-        if self.state != state:
+        if self.state != state and self.logger.debug_enabled:
             if self.current_device:
-                self.logger.output(f'[{self.current_device.address}] State changed to: {state}')
+                self.logger.debug('[%s] State changed to: %s', self.current_device.address, state)
             else:
-                self.logger.output(f'State changed to: {state}')
+                self.logger.debug('State changed to: %s', state)
 
         self.state = state
 
@@ -188,14 +284,14 @@ class BluetoothState:
         if addr_str not in self.devices:
             self.devices.append(addr_str)
 
-            self.logger.output('Found device:', addr_str, 'RSSI:', rssi, 'Adv Type:', adv_type, 'Addr Type:', addr_type)
+            if self.logger.debug_enabled:
+                self.logger.debug('Found device: %s RSSI: %d Adv Type: %d Addr Type: %d', addr_str, rssi, adv_type, addr_type)
 
     def handle_service_result(self, data: tuple):
         conn_handle, start_handle, end_handle, uuid = data
 
-        self.logger.output('Service:', uuid, type(uuid), f'{uuid}')
-        self.logger.output('  start_handle:', start_handle)
-        self.logger.output('  end_handle:', end_handle)
+        if self.logger.debug_enabled:
+            self.logger.debug('Service: %s start_handle: %d end_handle: %d', uuid, start_handle, end_handle)
 
         if uuid == bluetooth.UUID(0xff00):
             self.services_range = (start_handle, end_handle)
@@ -208,10 +304,8 @@ class BluetoothState:
     def handle_characteristic_result(self, data: tuple):
         _, end_handle, value_handle, properties, uuid = data
 
-        self.logger.output('characteristic:', uuid, type(uuid), f'{uuid}')
-        self.logger.output('  end_handle:', end_handle)
-        self.logger.output('  value_handle:', value_handle)
-        self.logger.output('  properties:', properties)
+        if self.logger.debug_enabled:
+            self.logger.debug('Characteristic: %s end_handle: %d value_handle: %d properties: %d', uuid, end_handle, value_handle, properties)
 
         if uuid == bluetooth.UUID(0xff01):
             self.current_device.set_notify_handle(value_handle)
@@ -223,8 +317,8 @@ class BluetoothState:
     def handle_descriptor_result(self, data: tuple):
         _, handle, uuid = data
 
-        self.logger.output('descriptor:', uuid, type(uuid), f'{uuid}')
-        self.logger.output('  handle:', handle)
+        if self.logger.debug_enabled:
+            self.logger.debug('Descriptor: %s handle: %d', uuid, handle)
 
         if uuid == bluetooth.UUID(0x2902):
             self.current_device.set_cccd_handle(handle)
@@ -242,6 +336,11 @@ class BluetoothState:
         if not self.current_device.notify_handle or not self.current_device.write_handle:
             raise Exception('Missing notify or write handle!')
 
+        heap.end(PHASE_DISCOVER)
+        trace.end(PHASE_DISCOVER, self.phase_started, trace.device(self.current_device.address))
+
+        self.remember_handles()
+
         self.set_state(STATE_READY)
 
     def handle_descriptor_done(self):
@@ -255,26 +354,42 @@ class BluetoothState:
         elif not self.current_device.cccd_handle:
             raise Exception('Missing CCCD handle!')
 
+        heap.end(PHASE_DISCOVER)
+        trace.end(PHASE_DISCOVER, self.phase_started, trace.device(self.current_device.address))
+
+        self.remember_handles()
+
         self.set_state(STATE_READY)
 
     def handle_notify(self, data: tuple):
         _, value_handle, notify_data = data
 
         if value_handle != self.current_device.notify_handle:
-            self.logger.output('Notification from unknown handle:', value_handle)
+            if self.logger.debug_enabled:
+                self.logger.debug('Notification from unknown handle: %d', value_handle)
 
             return
 
-        self.logger.output('Notification from handle:', value_handle, 'data:', "".join(["%02X" % i for i in notify_data]))
+        # Checked here rather than in the logger so nothing is allocated for logging with debug off
+        if self.logger.debug_enabled:
+            self.logger.debug('Notification from handle: %d data: %s', value_handle, hex_dump(notify_data))
+
+        heap.begin(PHASE_PARSE)
+        started_at = trace.begin()
 
         (response, is_voltages) = self.data_parser.parse_response(bytes(notify_data))
 
+        heap.end(PHASE_PARSE)
+        trace.end(PHASE_PARSE, started_at, trace.device(self.current_device.address))
+
         if is_voltages:
-            self.logger.output('cell_voltages', response)
+            if self.logger.debug_enabled:
+                self.logger.debug('cell_voltages: %s', response)
 
             self.data_parser.cell_voltages[self.current_device.address] = response['voltages']
         elif response is not None:
-            self.logger.output('response', response)
+            if self.logger.debug_enabled:
+                self.logger.debug('response: %s', response)
 
             self.data_parser.device_data[self.current_device.address] = response
 
@@ -305,15 +420,26 @@ class BluetoothState:
             'address': address,
         }
 
+        if 'timestamp' in device_data:
+            post_data['timestamp'] = device_data['timestamp']
+
+        elif 'ticks_ms' in device_data:
+            timestamp = time_sync.timestamp(device_data['ticks_ms'])
+            if timestamp is not None:
+                post_data['timestamp'] = timestamp
+
         if address in self.data_parser.cell_voltages:
             post_data['cell_voltages'] = self.data_parser.cell_voltages[address]
 
             del self.data_parser.cell_voltages[address]
 
-            gc.collect()
+        heap.begin(PHASE_UPLOAD)
+        started_at = trace.begin()
 
         try:
-            api_response = requests.post(
+            api_response = recovery.call(
+                SUBSYSTEM_HTTP,
+                requests.post,
                 f'{self.api_url}/{self.api_endpoint}',
                 headers={
                     'Authorization': f'Bearer {self.api_token}',
@@ -327,19 +453,23 @@ class BluetoothState:
 
             api_response.close()
 
+            heap.end(PHASE_UPLOAD)
+            trace.end(PHASE_UPLOAD, started_at, trace.device(address))
+
         except OSError as e:
-            if str(e.args[0]) != '-116':
-                self.logger.output('OSError getting latest version:', e)
-                if self.debug:
-                    sys.print_exception(e)
+            self.logger.warning('OSError sending battery data: %s', e)
+            if self.debug:
+                sys.print_exception(e)
 
-                machine.reset()
+            return False
 
         except Exception as e:
-            self.logger.output('Failed getting latest version:', e)
+            self.logger.warning('Error sending battery data: %s', e)
             if self.debug:
                 sys.print_exception(e)
 
+            return False
+
         return True
 
     def enable_notifications(self, enable: bool = True):
@@ -377,7 +507,8 @@ class BluetoothState:
             handle = self.current_device.write_handle
 
         if handle:
-            self.logger.output(f'Writing "{"".join(["%02X" % i for i in data])}" to handle {handle}...')
+            if self.logger.debug_enabled:
+                self.logger.debug('Writing "%s" to handle %d...', hex_dump(data), handle)
             self.bt.gattc_write(
                 self.conn_handle,
                 handle,
@@ -20,7 +20,8 @@ class DataParser:
         return (day * 86400) + (month * 2678400) + (year * 31536000)
 
     def parse_response(self, data: bytes) -> dict:
-        self.logger.output('DATA', len(data), data)
+        if self.logger.debug_enabled:
+            self.logger.debug('DATA %d %s', len(data), data)
 
         if data[0:2] == b'\xdd\x04':
             cell_count = int(int.from_bytes(data[3:4],'big') / 2)
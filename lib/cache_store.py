@@ -0,0 +1,59 @@
+import ujson as json
+
+from lib.utils import replace_file
+
+# cache.json held in memory. Changes only mark the store dirty, they are written to flash
+# together on the flush interval or before a reset.
+class CacheStore:
+    file_path: str
+    data: dict = {}
+    dirty: bool = False
+
+    def __init__(self, file_path: str = 'cache.json'):
+        self.file_path = file_path
+        self.data = {}
+        self.dirty = False
+
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.file_path, 'r') as f:
+                self.data = json.load(f)
+
+        except OSError as e:
+            if e.args[0] != 2:
+                print(f'OSError reading cache file: {e}')
+
+                from lib.recovery import recovery, SUBSYSTEM_STORAGE
+
+                recovery.reset(SUBSYSTEM_STORAGE, e)
+
+        except Exception:
+            self.data = {}
+
+    def get(self, key: str, default=None):
+        return self.data.get(key, default)
+
+    def set(self, key: str, value):
+        if key in self.data and self.data[key] == value:
+            return
+
+        self.data[key] = value
+
+        self.dirty = True
+
+    def flush(self):
+        if not self.dirty:
+            return
+
+        tmp_path = self.file_path + '.tmp'
+
+        with open(tmp_path, 'w') as f:
+            json.dump(self.data, f)
+
+        replace_file(tmp_path, self.file_path)
+
+        self.dirty = False
+
+cache_store = CacheStore()
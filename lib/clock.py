@@ -0,0 +1,88 @@
+import utime
+
+# Time as seen by the scheduler. In simulated mode nothing sleeps, sleeping only moves the clock forward,
+# so a day of scheduling can be run off the device in an instant.
+class Clock:
+    simulated: bool = False
+    now_ms: int = 0
+    start_time: int = 0
+    slept_ms: int = 0
+    light_sleeps: int = 0
+    deep_sleeps: int = 0
+
+    def simulate(self, start_time: int = 0):
+        self.simulated = True
+        self.now_ms = 0
+        self.start_time = start_time
+        self.slept_ms = 0
+        self.light_sleeps = 0
+        self.deep_sleeps = 0
+
+    def advance(self, delay_ms: int):
+        self.now_ms += delay_ms
+
+    def ticks_ms(self) -> int:
+        return self.now_ms if self.simulated else utime.ticks_ms()
+
+    def ticks_us(self) -> int:
+        return self.now_ms * 1000 if self.simulated else utime.ticks_us()
+
+    def ticks_add(self, ticks: int, delta: int) -> int:
+        return ticks + delta if self.simulated else utime.ticks_add(ticks, delta)
+
+    def ticks_diff(self, end: int, start: int) -> int:
+        return end - start if self.simulated else utime.ticks_diff(end, start)
+
+    def time(self) -> int:
+        return self.start_time + self.now_ms // 1000 if self.simulated else utime.time()
+
+    def localtime(self) -> tuple:
+        return utime.localtime(self.time())
+
+    def set_time(self, time: int):
+        if self.simulated:
+            self.start_time = time - self.now_ms // 1000
+
+            return
+
+        import machine
+
+        tm = utime.gmtime(time)
+        machine.RTC().datetime((tm[0], tm[1], tm[2], tm[6] + 1, tm[3], tm[4], tm[5], 0))
+
+    def sleep_ms(self, delay_ms: int):
+        if self.simulated:
+            self.advance(delay_ms)
+            self.slept_ms += delay_ms
+
+            return
+
+        utime.sleep_ms(delay_ms)
+
+    def sleep(self, seconds: int | float):
+        self.sleep_ms(int(seconds * 1000))
+
+    def lightsleep_ms(self, delay_ms: int):
+        if self.simulated:
+            self.sleep_ms(delay_ms)
+            self.light_sleeps += 1
+
+            return
+
+        import machine
+
+        machine.lightsleep(delay_ms)
+
+    def deepsleep_ms(self, delay_ms: int):
+        # Only returns when simulated, on the device waking up is a reset
+        if self.simulated:
+            self.sleep_ms(delay_ms)
+            self.deep_sleeps += 1
+
+            return
+
+        import machine
+
+        machine.deepsleep(delay_ms)
+
+clock = Clock()
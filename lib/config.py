@@ -1,8 +1,31 @@
+SNAPSHOT_FILE = 'config.snapshot'
+
+# Hash and size of config.json, written along with it so the snapshot can be matched without reading it
+CONFIG_HASH_FILE = 'config.hash'
+
+# Attributes which come from cache.json rather than the config files, so they are never part of the snapshot
+CACHE_ATTRIBUTES = ('last_updated', 'version', 'last_update_check', 'last_update_config_check', 'restart_counts', 'log_shipped_seq', 'config_etag', 'config_last_modified')
+
+# Attributes which are only applied during boot, a change to any of them needs a reset
+RESET_ATTRIBUTES = (
+    'bluetooth_enabled',
+    'water_sensor_in_pin',
+    'water_sensor_out_pin',
+    'temperature_sensor_scl_pin',
+    'temperature_sensor_sda_pin',
+    'watchdog_seconds',
+    'log_enabled',
+    'log_slots',
+)
+
 class Config:
     debug: bool
+    log_level: str
     reset_seconds: int
 
     last_updated: int
+    config_etag: str | None
+    config_last_modified: str | None
 
     api_url: str
     api_token: str
@@ -26,17 +49,67 @@ class Config:
     auto_update_enabled: bool
     update_github_repo: str
     update_github_src_dir: str
-    update_new_version_dir: str
+    update_health_boots: int
     update_api_token: str | None
+    update_archive_enabled: bool
+    update_slice_bytes: int
 
     auto_update_config_enabled: bool
     auto_update_config_url: str | None
     auto_update_config_token: str | None
 
-    def __init__(self, config: dict):
-        import gc
+    day_interval: int
+    night_interval: int
+    bluetooth_interval: int | None
+    config_check_interval: int
+    update_check_interval: int
+    cache_flush_interval: int
+
+    recovery_retries: int
+    recovery_backoff_ms: int
+    recovery_reinit_attempts: int
+    watchdog_seconds: int
+
+    heap_diagnostics_enabled: bool
+    trace_enabled: bool
+    diagnostics_interval: int
+    diagnostics_endpoint: str
+
+    log_enabled: bool
+    log_persist_level: str
+    log_slots: int
+    log_ship_interval: int
+    log_batch_size: int
+    log_endpoint: str
+
+    gc_watermark: int
+    gc_collect_interval_ms: int
+
+    time_servers: list[str]
+    time_timeout: int
+    time_sync_interval: int
+
+    radio_policy: str
+    radio_max_ble_window_seconds: int
+
+    power_mode: str
+    power_min_light_sleep_ms: int
+    power_deep_sleep_start_hour: int | None
+    power_deep_sleep_end_hour: int | None
+
+    def __init__(self, config: dict | None = None, *, snapshot: dict | None = None):
+        from lib.gc_policy import gc_policy
+
+        if snapshot is not None:
+            for key, value in snapshot.items():
+                setattr(self, key, value)
+
+            self.load_cache(Config.get_cache())
+
+            return
 
         self.debug = config.get('debug', False)
+        self.log_level = config.get('log_level', 'warning')
 
         self.load_cache(config.get('cache', {}))
 
@@ -47,7 +120,8 @@ class Config:
         self.battery_endpoint = config.get('api', {}).get('battery_endpoint', 'solar/battery/details')
         self.sensor_endpoint = config.get('api', {}).get('sensor_endpoint', 'solar/sensor/details')
         self.sensor_config_endpoint = config.get('api', {}).get('sensor_config_endpoint', 'solar/sensor/config')
-        self.sensor_config_last_updated_endpoint = config.get('api', {}).get('sensor_config_last_updated_endpoint', 'solar/sensor/config/last-updated')
+        self.diagnostics_endpoint = config.get('api', {}).get('diagnostics_endpoint', 'solar/sensor/diagnostics')
+        self.log_endpoint = config.get('api', {}).get('log_endpoint', 'solar/sensor/logs')
 
         self.wifi_networks = config.get('wifi', {})
 
@@ -65,13 +139,14 @@ class Config:
         self.auto_update_enabled = config.get('auto_update', {}).get('enabled', True)
         self.update_github_repo = config.get('auto_update', {}).get('github_repo', 'alexbarnsley/esp32-solar-sensor')
         self.update_github_src_dir = config.get('auto_update', {}).get('github_src_dir', None)
-        self.update_new_version_dir = config.get('auto_update', {}).get('new_version_dir', 'next')
+        self.update_health_boots = config.get('auto_update', {}).get('health_boots', 3)
         self.update_api_token = config.get('auto_update', {}).get('api_token', None)
+        self.update_archive_enabled = config.get('auto_update', {}).get('archive', True)
+        self.update_slice_bytes = config.get('auto_update', {}).get('slice_bytes', 32768)
 
         self.auto_update_config_enabled = config.get('auto_update', {}).get('config', {}).get('enabled', self.auto_update_enabled)
         self.auto_update_config_token = config.get('auto_update', {}).get('config', {}).get('api_token')
         self.auto_update_config_url = config.get('auto_update', {}).get('config', {}).get('url')
-        self.auto_update_config_check_url = config.get('auto_update', {}).get('config', {}).get('last_updated_url')
 
         if self.auto_update_config_url is None or len(self.auto_update_config_url) == 0:
             self.auto_update_config_url = self.api_url + '/' + self.sensor_config_endpoint
@@ -79,27 +154,79 @@ class Config:
             if self.auto_update_config_token is None:
                 self.auto_update_config_token = self.api_token
 
-        if self.auto_update_config_check_url is None or len(self.auto_update_config_check_url) == 0:
-            self.auto_update_config_check_url = self.api_url + '/' + self.sensor_config_last_updated_endpoint
+        self.day_interval = config.get('schedule', {}).get('day_interval', 10)
+        self.night_interval = config.get('schedule', {}).get('night_interval', 60)
+        self.bluetooth_interval = config.get('schedule', {}).get('bluetooth_interval')
+        self.config_check_interval = config.get('schedule', {}).get('config_check_interval', 3600)
+        self.update_check_interval = config.get('schedule', {}).get('update_check_interval', 3600)
+        self.cache_flush_interval = config.get('schedule', {}).get('cache_flush_interval', 300)
 
-            if self.auto_update_config_token is None:
-                self.auto_update_config_token = self.api_token
+        self.recovery_retries = config.get('recovery', {}).get('retries', 2)
+        self.recovery_backoff_ms = config.get('recovery', {}).get('backoff_ms', 500)
+        self.recovery_reinit_attempts = config.get('recovery', {}).get('reinit_attempts', 2)
+        self.watchdog_seconds = config.get('recovery', {}).get('watchdog_seconds', 120)
+
+        self.heap_diagnostics_enabled = config.get('diagnostics', {}).get('heap', False)
+        self.trace_enabled = config.get('diagnostics', {}).get('trace', True)
+        self.diagnostics_interval = config.get('diagnostics', {}).get('interval', 3600)
+
+        self.log_enabled = config.get('log', {}).get('enabled', True)
+        self.log_persist_level = config.get('log', {}).get('level', 'warning')
+        self.log_slots = config.get('log', {}).get('slots', 128)
+        self.log_ship_interval = config.get('log', {}).get('ship_interval', 900)
+        self.log_batch_size = config.get('log', {}).get('batch_size', 32)
+
+        self.gc_watermark = config.get('gc', {}).get('watermark', 24576)
+        self.gc_collect_interval_ms = config.get('gc', {}).get('collect_interval_ms', 5000)
+
+        self.time_servers = config.get('time', {}).get('servers', ['pool.ntp.org', 'time.google.com', 'time.cloudflare.com'])
+        self.time_timeout = config.get('time', {}).get('timeout', 2)
+        self.time_sync_interval = config.get('time', {}).get('sync_interval', 86400)
+
+        self.radio_policy = config.get('radio', {}).get('policy', 'windows')
+        self.radio_max_ble_window_seconds = config.get('radio', {}).get('max_ble_window_seconds', 120)
+
+        self.power_mode = config.get('power', {}).get('mode', 'awake')
+        self.power_min_light_sleep_ms = config.get('power', {}).get('min_light_sleep_ms', 1000)
+        self.power_deep_sleep_start_hour = config.get('power', {}).get('deep_sleep_start_hour')
+        self.power_deep_sleep_end_hour = config.get('power', {}).get('deep_sleep_end_hour')
 
         del config
 
-        gc.collect()
+        gc_policy.between_phases()
 
     def load_cache(self, config: dict):
+        from slot_state import slot_state
+
         self.last_updated = config.get('config_last_updated_at', 0)
-        self.version = config.get('version', '0.0.0')
+        # The slot pointer knows which version is actually running, including after a rollback
+        self.version = slot_state.version(config.get('version', '0.0.0'))
         self.last_update_check = config.get('last_update_check', 0)
         self.last_update_config_check = config.get('last_updated_config_check', 0)
+        self.restart_counts = config.get('restart_counts', {})
+        self.log_shipped_seq = config.get('log_shipped_seq', 0)
+        self.config_etag = config.get('config_etag')
+        self.config_last_modified = config.get('config_last_modified')
 
     @staticmethod
     def from_json_file(file_path: str) -> 'Config':
         import ujson as json
+        from slot_state import slot_state
+
+        default_file_path = slot_state.path('config.default.json')
+
+        # Every release runs from the other slot, so a snapshot compiled by the previous release is never reused
+        snapshot_key = f'{slot_state.active}:{slot_state.version("")}:{Config.stored_hash(file_path) or Config.content_hash(file_path)}'
 
-        with open('config.default.json', 'r') as f:
+        # A release never changes its default config, the tree in the root can be reflashed over USB though
+        if not slot_state.active:
+            snapshot_key += ':' + Config.content_hash(default_file_path)
+
+        snapshot = Config.load_snapshot(snapshot_key)
+        if snapshot is not None:
+            return Config(snapshot=snapshot)
+
+        with open(default_file_path, 'r') as f:
             default_config = json.load(f)
 
         with open(file_path, 'r') as f:
@@ -116,47 +243,127 @@ class Config:
         del config_data
         del cache_data
 
-        return Config(merged_config)
+        config = Config(merged_config)
+        config.save_snapshot(snapshot_key)
+
+        return config
 
     @staticmethod
-    def get_cache(key: str | None = None):
-        import machine
-        import ujson as json
+    def content_hash(*file_paths: str) -> str:
+        import hashlib, ubinascii
+
+        digest = hashlib.sha1()
+        buffer = bytearray(512)
+
+        for file_path in file_paths:
+            with open(file_path, 'rb') as f:
+                while True:
+                    size = f.readinto(buffer)
+                    if not size:
+                        break
+
+                    digest.update(memoryview(buffer)[:size])
+
+        return ubinascii.hexlify(digest.digest()).decode()
+
+    @staticmethod
+    def stored_hash(file_path: str) -> str | None:
+        import os
 
         try:
-            with open('cache.json', 'r') as f:
-                cache_data = json.load(f)
-                f.close()
+            with open(CONFIG_HASH_FILE, 'r') as f:
+                content_hash, size = f.read().split()
 
-            if key is not None:
-                return cache_data.get(key)
+            # A file replaced by hand does not update the stored hash, a change in size at least is noticed
+            if int(size) != os.stat(file_path)[6]:
+                return None
 
-            return cache_data
+            return content_hash
+
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def save_hash(file_path: str):
+        import os
+
+        try:
+            with open(CONFIG_HASH_FILE, 'w') as f:
+                f.write(f'{Config.content_hash(file_path)} {os.stat(file_path)[6]}')
 
         except OSError as e:
-            if e.args[0] != 2:
-                print(f'OSError reading cache file: {e}')
+            print(f'OSError saving config hash: {e}')
 
-                machine.reset()
+    @staticmethod
+    def clear_hash():
+        import os
 
-        except Exception:
+        try:
+            os.remove(CONFIG_HASH_FILE)
+
+        except OSError:
             pass
 
-        return None if key is not None else {}
+    @staticmethod
+    def load_snapshot(content_hash: str) -> dict | None:
+        import ujson as json
 
-    def update_cache(self, key: str, value):
-        import os
-        from lib.utils import copy_file, json_dumps_with_indent
+        try:
+            with open(SNAPSHOT_FILE, 'r') as f:
+                contents = f.read()
 
-        cache_data = Config.get_cache()
+        except OSError:
+            return None
+
+        # The first line holds the hash of the config files the snapshot was compiled from
+        separator = contents.find('\n')
+        if separator < 0 or contents[:separator] != content_hash:
+            return None
 
-        cache_data[key] = value
+        try:
+            return json.loads(contents[separator + 1:])
+
+        except ValueError:
+            return None
+
+    def save_snapshot(self, content_hash: str):
+        import ujson as json
+        from lib.utils import replace_file
+
+        snapshot = {
+            key: value
+            for key, value in self.__dict__.items() if key not in CACHE_ATTRIBUTES
+        }
 
-        with open('cache.json.tmp', 'w') as f:
-            f.write(json_dumps_with_indent(cache_data))
-            f.close()
+        try:
+            with open(SNAPSHOT_FILE + '.tmp', 'w') as f:
+                f.write(content_hash)
+                f.write('\n')
+                json.dump(snapshot, f)
+
+            replace_file(SNAPSHOT_FILE + '.tmp', SNAPSHOT_FILE)
+
+        except OSError as e:
+            print(f'OSError saving config snapshot: {e}')
+
+    def changed_attributes(self, other: 'Config') -> list[str]:
+        return [
+            key
+            for key, value in other.__dict__.items() if key not in CACHE_ATTRIBUTES and getattr(self, key, None) != value
+        ]
+
+    @staticmethod
+    def get_cache(key: str | None = None):
+        from lib.cache_store import cache_store
+
+        if key is not None:
+            return cache_store.get(key)
+
+        return cache_store.data
+
+    def update_cache(self, key: str, value):
+        from lib.cache_store import cache_store
 
-        copy_file('cache.json.tmp', 'cache.json')
-        os.remove('cache.json.tmp')
+        cache_store.set(key, value)
 
-        self.load_cache(cache_data)
+        self.load_cache(cache_store.data)
@@ -0,0 +1,163 @@
+import os
+import requests
+import sys
+import ujson as json
+
+from lib.clock import clock
+from lib.config import Config
+from lib.gc_policy import gc_policy
+from lib.heap import heap
+from lib.logger import Logger
+from lib.phases import PHASE_CONFIG_CHECK
+from lib.recovery import recovery, SUBSYSTEM_HTTP
+from lib.trace import trace
+from lib.utils import get_header, json_dump_with_indent, replace_file, save_stream
+from lib.wifi import WifiHandler
+
+DOWNLOAD_FILE = 'config.download.json'
+UPDATED_FILE = 'config.updated.json'
+
+# Checks for and downloads a new config in a single conditional request. The server answers 304 with
+# no body while the config is unchanged, and the config itself otherwise.
+class ConfigSync:
+    debug: bool = False
+    logger: Logger
+
+    def __init__(self, wifi: WifiHandler, config: Config, logger: Logger):
+        self.config = config
+        self.debug = config.debug
+        self.logger = logger
+        self.wifi = wifi
+        self.url = config.auto_update_config_url
+        self.api_token = config.auto_update_config_token
+
+    @property
+    def request_headers(self) -> dict:
+        headers = {
+            'User-Agent': 'esp32-solar-sensor-updater',
+        }
+
+        if self.api_token is not None:
+            headers['Authorization'] = f'Bearer {self.api_token}'
+
+        if self.config.config_etag:
+            headers['If-None-Match'] = self.config.config_etag
+
+        if self.config.config_last_modified:
+            headers['If-Modified-Since'] = self.config.config_last_modified
+
+        return headers
+
+    def sync(self) -> bool:
+        if not self.url or not self.wifi.is_connected:
+            return False
+
+        self.config.update_cache('last_updated_config_check', clock.time())
+
+        heap.begin(PHASE_CONFIG_CHECK)
+        started_at = trace.begin()
+
+        has_updated = False
+        try:
+            response = recovery.call(
+                SUBSYSTEM_HTTP,
+                requests.get,
+                self.url,
+                headers=self.request_headers,
+                json={
+                    "address": self.wifi.mac_address,
+                },
+                timeout=10,
+                stream=True,
+            )
+
+            try:
+                if response.status_code == 304:
+                    self.logger.output('Config file is up to date.')
+
+                elif response.status_code != 200:
+                    self.logger.output('Failed to fetch config file, status code:', response.status_code)
+
+                else:
+                    save_stream(response.raw, DOWNLOAD_FILE)
+
+                    has_updated = self.install(
+                        get_header(response.headers, 'ETag'),
+                        get_header(response.headers, 'Last-Modified'),
+                    )
+
+            finally:
+                response.close()
+
+            del response
+
+        except OSError as e:
+            # Already counted against the HTTP subsystem by recovery.call
+            self.logger.warning('OSError checking for config update: %s', e)
+            if self.debug:
+                sys.print_exception(e)
+
+        except Exception as e:
+            self.logger.warning('Error checking for config update: %s', e)
+            if self.debug:
+                sys.print_exception(e)
+
+        try:
+            os.remove(DOWNLOAD_FILE)
+
+        except OSError:
+            pass
+
+        heap.end(PHASE_CONFIG_CHECK)
+        trace.end(PHASE_CONFIG_CHECK, started_at)
+
+        gc_policy.between_phases()
+
+        return has_updated
+
+    def install(self, etag: str | None, last_modified: str | None) -> bool:
+        with open(DOWNLOAD_FILE, 'r') as f:
+            response_json = json.load(f)
+
+        if 'error' in response_json:
+            self.logger.output('Error fetching config file:', response_json['error'])
+
+            return False
+
+        if 'config' not in response_json:
+            self.logger.output('No config found in response, skipping config update.')
+
+            return False
+
+        config_updated_at = response_json.get('config_updated_at', clock.time())
+
+        # Servers which ignore the conditional headers answer 200 every time
+        if etag is not None or last_modified is not None:
+            is_unchanged = etag == self.config.config_etag and last_modified == self.config.config_last_modified
+        else:
+            is_unchanged = config_updated_at <= self.config.last_updated
+
+        if is_unchanged:
+            self.logger.output(f'Config file is up to date | config_updated_at: {config_updated_at} | last_updated: {self.config.last_updated}')
+
+            return False
+
+        with open(UPDATED_FILE, 'w') as f:
+            json_dump_with_indent(response_json['config'], f)
+
+        del response_json
+
+        # Cleared first, so a reset before the new hash is saved cannot leave the old one pointing at the new file
+        Config.clear_hash()
+
+        replace_file(UPDATED_FILE, 'config.json')
+
+        Config.save_hash('config.json')
+
+        self.config.update_cache('config_last_updated_at', config_updated_at)
+        self.config.update_cache('config_etag', etag)
+        self.config.update_cache('config_last_modified', last_modified)
+
+        self.logger.output('Config file updated successfully.')
+
+        return True
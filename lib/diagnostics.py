@@ -0,0 +1,86 @@
+import requests
+import sys
+
+from lib.clock import clock
+from lib.config import Config
+from lib.gc_policy import gc_policy
+from lib.heap import heap
+from lib.logger import Logger
+from lib.radio import radio
+from lib.recovery import recovery, SUBSYSTEM_HTTP
+from lib.trace import trace
+from lib.wifi import WifiHandler
+
+class Diagnostics:
+    debug: bool = False
+    logger: Logger
+
+    def __init__(self, wifi: WifiHandler, config: Config, logger: Logger):
+        self.debug = config.debug
+        self.logger = logger
+        self.wifi = wifi
+        self.api_url = config.api_url
+        self.api_endpoint = config.diagnostics_endpoint
+        self.api_token = config.api_token
+
+    def payload(self) -> dict:
+        payload = {
+            'address': self.wifi.mac_address,
+            'uptime_ms': clock.ticks_ms(),
+            'restarts': recovery.restart_counts,
+            'gc': gc_policy.stats(),
+        }
+
+        if trace.enabled:
+            payload['trace'] = trace.summary()
+
+        if heap.enabled:
+            payload['heap'] = heap.summary()
+
+        if radio.metrics:
+            payload['radio'] = radio.summary()
+
+        if self.wifi.connect_ms is not None:
+            payload['wifi'] = [self.wifi.connect_ms, 1 if self.wifi.connected_directly else 0]
+
+        update_stats = Config.get_cache('last_update_stats')
+        if update_stats is not None:
+            payload['update'] = update_stats
+
+        return payload
+
+    def send(self):
+        if self.debug and trace.enabled:
+            trace.dump()
+
+        if not self.api_endpoint or not self.wifi.is_connected:
+            return
+
+        self.logger.output('Sending diagnostics...')
+
+        try:
+            response = recovery.call(
+                SUBSYSTEM_HTTP,
+                requests.post,
+                f'{self.api_url}/{self.api_endpoint}',
+                headers={
+                    'Authorization': f'Bearer {self.api_token}',
+                    'Content-Type': 'application/json',
+                },
+                json=self.payload(),
+                timeout=10,
+            )
+
+            self.logger.output('Diagnostics sent:', response.status_code)
+
+            response.close()
+
+        except OSError as e:
+            self.logger.output(f'OSError sending diagnostics: {e}')
+            if self.debug:
+                sys.print_exception(e)
+
+        except Exception as e:
+            self.logger.output(f'Error sending diagnostics: {e}')
+            if self.debug:
+                sys.print_exception(e)
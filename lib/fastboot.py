@@ -0,0 +1,94 @@
+import machine
+import utime
+
+from lib.rtc_state import rtc_state
+from slot_state import slot_state
+
+has_delayed: bool = False
+# Cause passed to recovery.reset before the last reset, which the ESP32 port reports as a hard reset
+planned_reset: str | None = None
+first_reading_logged: bool = False
+
+def load_boot_config() -> dict:
+    import ujson as json
+
+    boot_config = {}
+    for file_path in (slot_state.path('config.default.json'), 'config.json'):
+        try:
+            with open(file_path, 'r') as f:
+                boot_config.update(json.load(f).get('boot', {}))
+
+        except Exception:
+            pass
+
+    return boot_config
+
+def startup_delay():
+    global has_delayed, planned_reset
+
+    # boot.py and main.py both call this, only the first call counts
+    if has_delayed:
+        return
+
+    has_delayed = True
+
+    boot_config = load_boot_config()
+
+    grace_seconds = boot_config.get('grace_seconds', 30)
+    fast_grace_seconds = boot_config.get('fast_grace_seconds', 0)
+    boot_loop_threshold = boot_config.get('boot_loop_threshold', 3)
+    repl_pin = boot_config.get('repl_pin')
+
+    reset_cause = machine.reset_cause()
+
+    # Cleared again once the first reading has been taken, so it only grows while the device keeps failing to boot
+    boot_count = rtc_state.get('boot_count', 0) + 1
+    rtc_state.set('boot_count', boot_count)
+    rtc_state.set('reset_cause', reset_cause)
+
+    # Only counts for the boot right after the reset
+    planned_reset = rtc_state.get('planned_reset')
+    rtc_state.set('planned_reset', None)
+
+    rtc_state.save()
+
+    if repl_pin is not None and machine.Pin(repl_pin, machine.Pin.IN, machine.Pin.PULL_UP).value() == 0:
+        reason = 'REPL pin held'
+        delay = grace_seconds
+
+    elif boot_count >= boot_loop_threshold:
+        reason = f'boot loop ({boot_count} boots without a reading)'
+        delay = grace_seconds
+
+    elif reset_cause in (machine.WDT_RESET, machine.SOFT_RESET, machine.DEEPSLEEP_RESET):
+        reason = 'fast boot'
+        delay = fast_grace_seconds
+
+    elif planned_reset is not None:
+        reason = f'fast boot after {planned_reset} reset'
+        delay = fast_grace_seconds
+
+    else:
+        reason = 'power on'
+        delay = grace_seconds
+
+    print(f'Reset cause: {reset_cause}, waiting {delay}s ({reason})...')
+
+    if delay > 0:
+        utime.sleep(delay)
+
+def mark_first_reading(logger):
+    global first_reading_logged
+
+    if first_reading_logged:
+        return
+
+    first_reading_logged = True
+
+    logger.output(f'Time to first reading: {utime.ticks_ms()}ms after reset (cause: {rtc_state.get("reset_cause")})')
+
+    rtc_state.set('boot_count', 0)
+    rtc_state.save()
+
+    # A release which has taken a reading and uploaded it has passed its health check
+    slot_state.mark_healthy()
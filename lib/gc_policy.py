@@ -0,0 +1,102 @@
+import gc
+
+from lib.clock import clock
+
+# Minimum and maximum bytes allocated between automatic collections
+MIN_THRESHOLD = 4096
+MAX_THRESHOLD = 65536
+
+class GCPolicy:
+    watermark: int = 24576
+    collect_interval_ms: int = 5000
+    threshold: int = -1
+    critical_depth: int = 0
+    collections: int = 0
+    pause_total_us: int = 0
+    pause_max_us: int = 0
+    allocation_rate: int = 0
+    last_allocated: int = 0
+    last_ticks: int = 0
+
+    def __init__(self):
+        self.critical_depth = 0
+        self.collections = 0
+        self.pause_total_us = 0
+        self.pause_max_us = 0
+        self.allocation_rate = 0
+        self.threshold = -1
+        self.last_allocated = gc.mem_alloc()
+        self.last_ticks = clock.ticks_ms()
+
+    def configure(self, config):
+        self.watermark = config.gc_watermark
+        self.collect_interval_ms = config.gc_collect_interval_ms
+
+    def collect(self):
+        start = clock.ticks_us()
+
+        gc.collect()
+
+        pause_us = clock.ticks_diff(clock.ticks_us(), start)
+
+        self.collections += 1
+        self.pause_total_us += pause_us
+        self.pause_max_us = max(self.pause_max_us, pause_us)
+
+        self.last_allocated = gc.mem_alloc()
+        self.last_ticks = clock.ticks_ms()
+
+    def between_phases(self):
+        if self.critical_depth > 0:
+            return
+
+        self.update_threshold()
+
+        if gc.mem_free() < self.watermark:
+            self.collect()
+
+    def update_threshold(self):
+        now = clock.ticks_ms()
+        elapsed_ms = clock.ticks_diff(now, self.last_ticks)
+        if elapsed_ms < 100:
+            return
+
+        # An automatic collection in between makes the difference negative, skip that sample
+        allocated = gc.mem_alloc() - self.last_allocated
+        if allocated >= 0:
+            self.allocation_rate = (self.allocation_rate + allocated * 1000 // elapsed_ms) // 2
+
+        self.last_allocated = gc.mem_alloc()
+        self.last_ticks = now
+
+        # Let the heap fill for about one collect interval, but never past the watermark
+        threshold = self.allocation_rate * self.collect_interval_ms // 1000
+        threshold = min(threshold, max(gc.mem_free() - self.watermark, MIN_THRESHOLD))
+        threshold = max(MIN_THRESHOLD, min(threshold, MAX_THRESHOLD))
+
+        if threshold != self.threshold:
+            self.threshold = threshold
+
+            gc.threshold(threshold)
+
+    def enter_critical(self):
+        self.critical_depth += 1
+
+        if self.critical_depth == 1:
+            # No threshold collections during latency-sensitive exchanges, an exhausted heap still collects
+            gc.threshold(-1)
+
+    def exit_critical(self):
+        if self.critical_depth == 0:
+            return
+
+        self.critical_depth -= 1
+
+        if self.critical_depth == 0:
+            gc.threshold(self.threshold)
+
+    def stats(self) -> list[int]:
+        # [collections, total pause, longest pause, allocation rate in bytes per second]
+        return [self.collections, self.pause_total_us, self.pause_max_us, self.allocation_rate]
+
+gc_policy = GCPolicy()
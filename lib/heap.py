@@ -0,0 +1,101 @@
+import gc
+
+from lib.gc_policy import gc_policy
+from lib.phases import PHASE_NAMES
+
+STAT_SAMPLES = 0
+STAT_MIN_FREE = 1
+STAT_MAX_FREE = 2
+STAT_MIN_LARGEST = 3
+STAT_MAX_LARGEST = 4
+STAT_MAX_ALLOCATED = 5
+STAT_LARGEST_SAMPLES = 6
+
+# Precision of the largest free block probe, in bytes
+LARGEST_BLOCK_PRECISION = 256
+
+def largest_free_block(free: int) -> int:
+    # Binary search for the largest allocation which still succeeds
+    low = 0
+    high = free
+    while high - low > LARGEST_BLOCK_PRECISION:
+        size = (low + high) // 2
+
+        try:
+            block = bytearray(size)
+            del block
+
+            low = size
+
+        except MemoryError:
+            high = size
+
+    return low
+
+class HeapMonitor:
+    enabled: bool = False
+    stats: list[list[int]] = []
+    start_allocated: list[int] = []
+
+    def __init__(self):
+        self.enabled = False
+        self.stats = []
+        self.start_allocated = []
+
+    def enable(self, enabled: bool = True):
+        self.enabled = enabled
+
+        if enabled and not self.stats:
+            for _ in PHASE_NAMES:
+                self.stats.append([0, 0, 0, 0, 0, 0, 0])
+                self.start_allocated.append(0)
+
+    def begin(self, phase: int):
+        if not self.enabled:
+            return
+
+        self.start_allocated[phase] = gc.mem_alloc()
+
+    def end(self, phase: int):
+        if not self.enabled:
+            return
+
+        free = gc.mem_free()
+        allocated = gc.mem_alloc() - self.start_allocated[phase]
+
+        stats = self.stats[phase]
+        if stats[STAT_SAMPLES] == 0:
+            stats[STAT_MIN_FREE] = stats[STAT_MAX_FREE] = free
+            stats[STAT_MAX_ALLOCATED] = allocated
+        else:
+            stats[STAT_MIN_FREE] = min(stats[STAT_MIN_FREE], free)
+            stats[STAT_MAX_FREE] = max(stats[STAT_MAX_FREE], free)
+            stats[STAT_MAX_ALLOCATED] = max(stats[STAT_MAX_ALLOCATED], allocated)
+
+        stats[STAT_SAMPLES] += 1
+
+        # The probe fills the heap, inside a critical section collections are paused so it is skipped there
+        if gc_policy.critical_depth > 0:
+            return
+
+        largest = largest_free_block(free)
+
+        if stats[STAT_LARGEST_SAMPLES] == 0:
+            stats[STAT_MIN_LARGEST] = stats[STAT_MAX_LARGEST] = largest
+        else:
+            stats[STAT_MIN_LARGEST] = min(stats[STAT_MIN_LARGEST], largest)
+            stats[STAT_MAX_LARGEST] = max(stats[STAT_MAX_LARGEST], largest)
+
+        stats[STAT_LARGEST_SAMPLES] += 1
+
+    def summary(self) -> dict | None:
+        if not self.enabled:
+            return None
+
+        # [samples, min free, max free, min largest block, max largest block, max allocated during the phase, samples of the largest block]
+        return {
+            PHASE_NAMES[phase]: stats
+            for phase, stats in enumerate(self.stats) if stats[STAT_SAMPLES] > 0
+        }
+
+heap = HeapMonitor()
@@ -0,0 +1,221 @@
+import os
+import struct
+import sys
+
+from lib.clock import clock
+from lib.logger import Logger
+
+HEADER_FORMAT = '<IIBB'
+HEADER_SIZE = 10
+RECORD_SIZE = 64
+MESSAGE_SIZE = RECORD_SIZE - HEADER_SIZE
+
+# Drops a character cut off at the end of the data, so a message shortened to fit a record still decodes
+def whole_characters(data: bytes) -> bytes:
+    start = len(data)
+    while start > 0 and len(data) - start < 3 and data[start - 1] & 0xc0 == 0x80:
+        start -= 1
+
+    if start == 0 or data[start - 1] < 0x80:
+        return data
+
+    lead = data[start - 1]
+    needed = 2 if lead < 0xe0 else 3 if lead < 0xf0 else 4
+
+    return data if len(data) - start + 1 >= needed else data[:start - 1]
+
+# Fixed-size ring of log records on flash. Records are buffered in RAM and written in
+# batches to consecutive slots, so each flush touches as few flash blocks as possible.
+class LogRing:
+    file_path: str
+    slots: int
+    buffer_size: int
+    next_seq: int = 1
+    next_slot: int = 0
+    buffer: list[bytes] = []
+
+    def __init__(self, file_path: str = 'log.bin', slots: int = 128, buffer_size: int = 8):
+        self.file_path = file_path
+        self.slots = slots
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.next_seq = 1
+        self.next_slot = 0
+
+        self.open()
+
+    def open(self):
+        try:
+            size = os.stat(self.file_path)[6]
+
+        except OSError:
+            size = 0
+
+        if size != self.slots * RECORD_SIZE:
+            empty_record = bytes(RECORD_SIZE)
+
+            with open(self.file_path, 'wb') as f:
+                for _ in range(self.slots):
+                    f.write(empty_record)
+
+            return
+
+        # Continue after the newest record
+        newest_seq = 0
+        for slot, seq, _, _ in self.headers():
+            if seq > newest_seq:
+                newest_seq = seq
+                self.next_slot = (slot + 1) % self.slots
+
+        self.next_seq = newest_seq + 1
+
+    def headers(self):
+        header = bytearray(HEADER_SIZE)
+
+        with open(self.file_path, 'rb') as f:
+            for slot in range(self.slots):
+                f.seek(slot * RECORD_SIZE)
+                f.readinto(header)
+
+                seq, timestamp, level, length = struct.unpack(HEADER_FORMAT, header)
+                if seq > 0:
+                    yield slot, seq, timestamp, level
+
+    def append(self, level: int, message: str):
+        encoded = whole_characters(message.encode()[:MESSAGE_SIZE])
+
+        record = bytearray(RECORD_SIZE)
+        struct.pack_into(HEADER_FORMAT, record, 0, self.next_seq, clock.time(), level, len(encoded))
+        record[HEADER_SIZE:HEADER_SIZE + len(encoded)] = encoded
+
+        self.buffer.append(record)
+        self.next_seq += 1
+
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+
+        with open(self.file_path, 'r+b') as f:
+            f.seek(self.next_slot * RECORD_SIZE)
+
+            for record in self.buffer:
+                f.write(record)
+
+                self.next_slot = (self.next_slot + 1) % self.slots
+                if self.next_slot == 0:
+                    f.seek(0)
+
+        self.buffer = []
+
+    def entries_after(self, seq: int, limit: int) -> list[tuple]:
+        self.flush()
+
+        slots = sorted((entry for entry in self.headers() if entry[1] > seq), key=lambda entry: entry[1])[:limit]
+
+        entries = []
+        record = bytearray(RECORD_SIZE)
+        with open(self.file_path, 'rb') as f:
+            for slot, entry_seq, timestamp, level in slots:
+                f.seek(slot * RECORD_SIZE)
+                f.readinto(record)
+
+                length = record[HEADER_SIZE - 1]
+
+                # Records written before messages were cut on a character boundary may end mid character
+                entries.append((entry_seq, timestamp, level, whole_characters(bytes(record[HEADER_SIZE:HEADER_SIZE + length]))))
+
+        return entries
+
+def compress(data: bytes) -> tuple:
+    try:
+        import deflate, io
+
+        stream = io.BytesIO()
+        with deflate.DeflateIO(stream, deflate.ZLIB) as compressor:
+            compressor.write(data)
+
+        return stream.getvalue(), 'deflate'
+
+    except Exception:
+        # Firmware built without deflate compression
+        return data, None
+
+class LogShipper:
+    debug: bool = False
+    logger: Logger
+
+    def __init__(self, log_ring: LogRing, wifi, config, logger: Logger):
+        self.log_ring = log_ring
+        self.wifi = wifi
+        self.config = config
+        self.debug = config.debug
+        self.logger = logger
+        self.api_url = config.api_url
+        self.api_endpoint = config.log_endpoint
+        self.api_token = config.api_token
+        self.batch_size = config.log_batch_size
+
+    def send(self):
+        import requests
+        from lib.recovery import recovery, SUBSYSTEM_HTTP
+
+        if not self.api_endpoint or not self.wifi.is_connected:
+            return
+
+        shipped_seq = self.config.log_shipped_seq
+        if shipped_seq >= self.log_ring.next_seq:
+            # The ring was recreated, start over
+            shipped_seq = 0
+
+        entries = self.log_ring.entries_after(shipped_seq, self.batch_size)
+        if not entries:
+            return
+
+        lines = []
+        for seq, timestamp, level, message in entries:
+            lines.append(f'{seq}\t{timestamp}\t{level}\t{message.decode()}')
+
+        body, encoding = compress('\n'.join(lines).encode())
+
+        del lines
+
+        headers = {
+            'Authorization': f'Bearer {self.api_token}',
+            'Content-Type': 'text/plain',
+            'X-Device-Address': self.wifi.mac_address,
+        }
+
+        if encoding is not None:
+            headers['Content-Encoding'] = encoding
+
+        try:
+            response = recovery.call(
+                SUBSYSTEM_HTTP,
+                requests.post,
+                f'{self.api_url}/{self.api_endpoint}',
+                headers=headers,
+                data=body,
+                timeout=10,
+            )
+
+            status_code = response.status_code
+
+            response.close()
+
+            if status_code < 300:
+                self.config.update_cache('log_shipped_seq', entries[-1][0])
+
+            self.logger.output(f'Shipped {len(entries)} log entries ({len(body)} bytes):', status_code)
+
+        except OSError as e:
+            self.logger.output(f'OSError shipping logs: {e}')
+            if self.debug:
+                sys.print_exception(e)
+
+        except Exception as e:
+            self.logger.output(f'Error shipping logs: {e}')
+            if self.debug:
+                sys.print_exception(e)
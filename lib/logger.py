@@ -1,20 +1,102 @@
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVELS = {
+    'debug': DEBUG,
+    'info': INFO,
+    'warning': WARNING,
+    'error': ERROR,
+}
+
+LEVEL_NAMES = {
+    DEBUG: 'DEBUG',
+    INFO: 'INFO',
+    WARNING: 'WARNING',
+    ERROR: 'ERROR',
+}
+
+def hex_dump(data) -> str:
+    import ubinascii
+
+    return ubinascii.hexlify(data).decode().upper()
+
 class Logger:
-    debug: bool
+    level: int = WARNING
+    debug_enabled: bool = False
+    sink = None
+    sink_level: int = WARNING
+
+    def set_level(self, level: int):
+        self.level = level
+        # Plain attribute so hot paths can skip building log arguments without a call
+        self.debug_enabled = level <= DEBUG
 
     def set_debug(self, debug: bool):
-        self.debug = debug
+        self.set_level(DEBUG if debug else WARNING)
+
+    def set_sink(self, sink, level: int = WARNING):
+        self.sink = sink
+        self.sink_level = level
+
+    def enabled_for(self, level: int) -> bool:
+        return level >= self.level or (self.sink is not None and level >= self.sink_level)
+
+    def flush(self):
+        if self.sink is None:
+            return
+
+        try:
+            self.sink.flush()
+
+        except Exception as e:
+            print('Error flushing log:', e)
+
+    # The message and any callable arguments are only evaluated if the level is enabled
+    def log(self, level: int, message, *args):
+        if not self.enabled_for(level):
+            return
+
+        if callable(message):
+            message = message()
+
+        if args:
+            message = message % tuple(arg() if callable(arg) else arg for arg in args)
+
+        if level >= self.level:
+            print(f'{LEVEL_NAMES[level]} [{self.datetime}]:', message)
+
+        if self.sink is not None and level >= self.sink_level:
+            try:
+                self.sink.append(level, message)
+
+            except Exception as e:
+                print('Error writing log:', e)
+
+    def debug(self, message, *args):
+        self.log(DEBUG, message, *args)
+
+    def info(self, message, *args):
+        self.log(INFO, message, *args)
+
+    def warning(self, message, *args):
+        self.log(WARNING, message, *args)
+
+    def error(self, message, *args):
+        self.log(ERROR, message, *args)
 
     def output(self, *args):
-        if not self.debug:
+        if not self.debug_enabled:
             return
 
         print(f'DEBUG [{self.datetime}]:', *args)
 
     @property
     def datetime(self) -> str:
-        import utime
+        from lib.clock import clock
 
-        tm = utime.localtime()
+        tm = clock.localtime()
 
         return f'{tm[0]:04}-{tm[1]:02}-{tm[2]:02} {tm[3]:02}:{tm[4]:02}:{tm[5]:02}'
 
@@ -1,12 +1,26 @@
 import gc
-import sys
-import utime
 import machine
+import sys
 
-from lib.logger import logger
-from lib.config import Config
+from lib.fastboot import mark_first_reading
+from lib.gc_policy import gc_policy
+from lib.heap import heap
+from lib.logger import logger, DEBUG, LEVELS, WARNING
+from lib.phases import PHASE_FETCH, PHASE_SAMPLE, PHASE_SCAN, PHASE_WIFI_CHECK
+from lib.power import power
+from lib.radio import radio, RADIO_BLE, RADIO_WIFI
+from lib.recovery import recovery, SUBSYSTEM_BLUETOOTH, SUBSYSTEM_HTTP, SUBSYSTEM_SENSOR, SUBSYSTEM_STORAGE, SUBSYSTEM_WIFI
+from lib.config import Config, RESET_ATTRIBUTES
+from lib.config_sync import ConfigSync
+from lib.diagnostics import Diagnostics
+from lib.cache_store import cache_store
+from lib.clock import clock
 from lib.bluetooth_device.bluetooth_state import BluetoothState, STATE_CONNECTED, STATE_DISCONNECTED, STATE_IDLE, STATE_SCANNING, STATE_READY
+from lib.rtc_state import rtc_state
+from lib.scheduler import Scheduler, Task
 from lib.sensor import Sensor
+from lib.time_sync import time_sync
+from lib.trace import trace
 from lib.utils import wait_for
 from lib.wifi import WifiHandler
 
@@ -17,11 +31,17 @@ class MonitorDevice:
     debug: bool = False
     reset_seconds: int = 3600
     config: Config
-    sensor: Sensor
+    sensor: Sensor | None = None
     wifi: WifiHandler
+    diagnostics: Diagnostics
+    config_sync: ConfigSync
     with_bluetooth: bool = False
     with_temperature_sensor: bool = False
     with_water_sensor: bool = False
+    scheduler: Scheduler
+    bluetooth_cursor: int = 0
+    pending_uploads: list[str] = []
+    updater = None
 
     def __init__(self, config: Config):
         self.config = config
@@ -32,15 +52,42 @@ class MonitorDevice:
         self.with_water_sensor = config.water_sensor_enabled
         self.with_bluetooth = config.bluetooth_enabled
         self.last_updated = {}
+        self.bluetooth_cursor = 0
+        self.pending_uploads = []
+        self.updater = None
+
+        logger.set_level(DEBUG if self.debug else LEVELS.get(config.log_level, WARNING))
+
+        if config.log_enabled:
+            from lib.log_ring import LogRing
+
+            self.log_ring = LogRing(slots=config.log_slots)
+
+            logger.set_sink(self.log_ring, LEVELS.get(config.log_persist_level, WARNING))
 
-        logger.set_debug(self.debug)
+        heap.enable(config.heap_diagnostics_enabled)
+        trace.enable(config.trace_enabled)
 
         gc.enable()
 
+        gc_policy.configure(config)
+
+        recovery.configure(config)
+
+        time_sync.configure(config)
+
+        power.configure(config)
+
+        if recovery.restart_counts:
+            self.logger.output('Restart counts by cause:', recovery.restart_counts)
+
         self.wifi = WifiHandler(config, logger=self.logger)
 
-        # We check for updates here once we've established a wifi connection
-        self.check_for_updates()
+        recovery.register(SUBSYSTEM_WIFI, self.wifi.reinitialize)
+        recovery.register(SUBSYSTEM_HTTP, self.reinitialize_http)
+        recovery.observe(SUBSYSTEM_HTTP, radio.http_request)
+
+        radio.configure(config)
 
         if self.with_bluetooth:
             self.logger.output('Initializing Bluetooth state...')
@@ -49,92 +96,315 @@ class MonitorDevice:
 
             self.set_bluetooth_devices(config.bluetooth_devices)
 
+            recovery.register(SUBSYSTEM_BLUETOOTH, self.bluetooth_state.reinitialize)
+
+        # bluetooth.BLE() is a singleton, so the object stays valid when the stack is reinitialized
+        radio.attach(self.wifi.wlan, self.bluetooth_state.bt if self.with_bluetooth else None, self.wifi.check_connection)
+
         if self.with_temperature_sensor or self.with_water_sensor:
             self.logger.output('Initializing Sensor...')
 
             self.sensor = Sensor(self.wifi, config, logger=self.logger)
 
+            recovery.register(SUBSYSTEM_SENSOR, self.sensor.reinitialize)
+
+        self.diagnostics = Diagnostics(self.wifi, config, logger=self.logger)
+        self.config_sync = ConfigSync(self.wifi, config, logger=self.logger)
+
+        if config.log_enabled:
+            from lib.log_ring import LogShipper
+
+            self.log_shipper = LogShipper(self.log_ring, self.wifi, config, logger=self.logger)
+
+        power.before_deep_sleep(self.save_state)
+
+        if machine.reset_cause() == machine.DEEPSLEEP_RESET:
+            self.restore_state()
+
+        self.setup_tasks()
+
+        # Checked once everything is set up, so a new config can be applied in place
+        self.check_config_update()
+
         self.logger.output('MonitorDevice initialized.')
 
     def set_bluetooth_devices(self, devices: list[str]):
         self.bluetooth_devices = devices
         self.bluetooth_state.only_devices = devices
+        self.bluetooth_cursor = 0
 
-    def run(self):
-        while True:
+    def setup_tasks(self):
+        self.scheduler = Scheduler(self.logger)
+
+        self.schedule_tasks()
+
+    def schedule_tasks(self):
+        config = self.config
+        scheduler = self.scheduler
+
+        with_sensor = self.with_temperature_sensor or self.with_water_sensor
+        bluetooth_interval = config.bluetooth_interval if config.bluetooth_interval else self.polling_interval
+
+        scheduler.schedule('sensor_sample', self.sample_sensor, enabled=with_sensor, interval=self.polling_interval, deadline=5, budget_ms=2000)
+        scheduler.schedule('bluetooth_poll', self.poll_bluetooth, enabled=self.with_bluetooth, interval=bluetooth_interval, deadline=30, budget_ms=45000, radio=RADIO_BLE)
+        scheduler.schedule('time_sync', self.sync_time, interval=time_sync.interval, deadline=60, budget_ms=10000, delay=time_sync.seconds_until_due(), radio=RADIO_WIFI)
+        scheduler.schedule('upload', self.upload_data, interval=self.polling_interval, deadline=10, budget_ms=30000, delay=5, radio=RADIO_WIFI)
+        scheduler.schedule('config_check', self.check_config_update, enabled=config.auto_update_enabled and config.auto_update_config_enabled, interval=config.config_check_interval, deadline=600, budget_ms=15000, delay=30, radio=RADIO_WIFI)
+        scheduler.schedule('diagnostics', self.send_diagnostics, interval=config.diagnostics_interval, deadline=600, budget_ms=15000, delay=config.diagnostics_interval, radio=RADIO_WIFI)
+        scheduler.schedule('deep_sleep', self.check_deep_sleep, enabled=power.deep_sleep_enabled, interval=60, deadline=60, budget_ms=1000, delay=60)
+        scheduler.schedule('cache_flush', self.flush_cache, interval=config.cache_flush_interval, deadline=60, budget_ms=1000, delay=config.cache_flush_interval)
+        scheduler.schedule('log_ship', self.ship_logs, enabled=config.log_enabled, interval=config.log_ship_interval, deadline=600, budget_ms=15000, delay=config.log_ship_interval, radio=RADIO_WIFI)
+        scheduler.schedule('update_check', self.check_for_updates, interval=config.update_check_interval, deadline=600, budget_ms=3000, delay=60, radio=RADIO_WIFI)
+
+    def reinitialize_http(self, attempt: int = 1):
+        # Free any sockets left behind by the failed request first, only cycle the WLAN if that was not enough
+        gc_policy.collect()
+
+        if attempt > 1:
+            self.wifi.reinitialize(attempt)
+        else:
             self.wifi.check_connection()
 
-            gc.collect()
+    def polling_interval(self) -> int:
+        hour = clock.localtime()[3]
+        if hour > 9 and hour < 18:
+            return self.config.day_interval
+
+        return self.config.night_interval
 
-            if self.with_temperature_sensor or self.with_water_sensor:
-                try:
-                    self.sensor.update_data()
+    def run(self):
+        self.scheduler.run()
 
-                except OSError as e:
-                    self.logger.output(f'OSError updating sensor data: {e}')
-                    if self.debug:
-                        sys.print_exception(e)
+    def sample_sensor(self, task: Task):
+        started_at = trace.begin()
 
-                    machine.reset()
+        try:
+            self.sensor.sample()
 
-                except Exception as e:
-                    self.logger.output(f'Error updating sensor data: {e}')
-                    if self.debug:
-                        sys.print_exception(e)
+            trace.end(PHASE_SAMPLE, started_at)
 
-            gc.collect()
+        except OSError as e:
+            self.logger.warning('OSError sampling sensor data: %s', e)
+            if self.debug:
+                sys.print_exception(e)
 
-            if self.with_bluetooth and self.bluetooth_devices:
-                try:
-                    self.update_bluetooth()
+            recovery.failure(SUBSYSTEM_SENSOR, e)
 
-                except OSError as e:
-                    self.logger.output(f'OSError updating Bluetooth devices: {e}')
-                    if self.debug:
-                        sys.print_exception(e)
+        except Exception as e:
+            self.logger.warning('Error sampling sensor data: %s', e)
+            if self.debug:
+                sys.print_exception(e)
 
-                    machine.reset()
+    def poll_bluetooth(self, task: Task):
+        if not self.bluetooth_devices:
+            return
 
-                except Exception as e:
-                    self.logger.output(f'Error updating Bluetooth devices: {e}')
-                    if self.debug:
-                        sys.print_exception(e)
+        # WiFi tasks wait until the sweep is over, including between the slices of a sweep spread over several runs
+        radio.begin_ble()
 
-                for device_address in self.bluetooth_devices:
-                    last_updated = self.last_updated.get(device_address)
-                    if last_updated is None:
-                        continue
+        try:
+            self.update_bluetooth(task)
 
-                    if self.reset_seconds > 0 and utime.time() - last_updated > self.reset_seconds:
-                        self.logger.output(f'No bluetooth updates for {device_address} in the last hour, restarting.')
+        except OSError as e:
+            self.logger.warning('OSError updating Bluetooth devices: %s', e)
+            if self.debug:
+                sys.print_exception(e)
 
-                        machine.reset()
+            recovery.failure(SUBSYSTEM_BLUETOOTH, e)
 
-            gc.collect()
+            radio.end_ble()
 
-            self.check_config_update()
+        except Exception as e:
+            self.logger.warning('Error updating Bluetooth devices: %s', e)
+            if self.debug:
+                sys.print_exception(e)
 
-            self.sleep()
+            radio.end_ble()
 
-    def sleep(self):
-        hour = utime.localtime()[3]
-        if hour > 9 and hour < 18:
-            pause_delay = 10
-        else:
-            pause_delay = 60
+        if self.bluetooth_cursor == 0:
+            radio.end_ble()
+
+        for device_address in self.bluetooth_devices:
+            last_updated = self.last_updated.get(device_address)
+            if last_updated is None:
+                continue
+
+            # Ticks, so setting the clock cannot make a device look silent
+            if self.reset_seconds > 0 and clock.ticks_diff(clock.ticks_ms(), last_updated) > self.reset_seconds * 1000:
+                self.logger.output(f'No bluetooth updates for {device_address} in the last hour, recovering.')
+
+                # Restart the clock so the next step of the recovery ladder is only taken after another silent period
+                self.last_updated[device_address] = clock.ticks_ms()
+
+                recovery.failure(SUBSYSTEM_BLUETOOTH, f'no updates from {device_address}')
+
+        gc_policy.between_phases()
+
+    def upload_data(self, task: Task):
+        started_at = trace.begin()
+
+        self.wifi.check_connection()
+
+        trace.end(PHASE_WIFI_CHECK, started_at)
+
+        if self.with_temperature_sensor or self.with_water_sensor:
+            try:
+                # The health check of a new release only passes on a reading the server has confirmed
+                if self.sensor.update_data():
+                    mark_first_reading(self.logger)
+
+            except OSError as e:
+                self.logger.warning('OSError updating sensor data: %s', e)
+                if self.debug:
+                    sys.print_exception(e)
+
+            except Exception as e:
+                self.logger.warning('Error updating sensor data: %s', e)
+                if self.debug:
+                    sys.print_exception(e)
+
+        while self.pending_uploads and not task.budget_exceeded():
+            device_address = self.pending_uploads.pop(0)
+
+            if self.bluetooth_state.save_data(device_address):
+                mark_first_reading(self.logger)
+
+            elif device_address in self.bluetooth_state.data_parser.device_data:
+                # Keep the reading for the next upload window
+                self.pending_uploads.append(device_address)
+
+                break
+
+            gc_policy.between_phases()
+
+        if self.pending_uploads:
+            self.logger.output(f'Upload budget spent, {len(self.pending_uploads)} device uploads deferred.')
+
+            task.run_in(1)
+
+    def sync_time(self, task: Task):
+        if not self.wifi.is_connected or not time_sync.sync():
+            # Readings keep their ticks until then, and are stamped once the time is known
+            task.run_in(60)
+
+    def check_deep_sleep(self, task: Task):
+        seconds = power.deep_sleep_seconds()
+        if seconds <= 0:
+            return
+
+        # A sweep in progress is finished first, its readings are carried over the sleep
+        if radio.window == RADIO_BLE:
+            return
+
+        power.deep_sleep(seconds)
+
+    # RAM does not survive deep sleep, what is needed to upload straight after waking is kept in RTC memory
+    def save_state(self):
+        carry = {
+            'cursor': self.bluetooth_cursor,
+            'radio': radio.metrics,
+        }
+
+        # Ticks restart from zero on waking, so readings are carried with a timestamp instead
+        if self.sensor is not None and self.sensor.reading is not None:
+            timestamp = time_sync.timestamp(self.sensor.reading_ticks)
+            if timestamp is not None:
+                self.sensor.reading['timestamp'] = timestamp
+
+            carry['reading'] = self.sensor.reading
+
+        if self.with_bluetooth and self.pending_uploads:
+            data_parser = self.bluetooth_state.data_parser
+
+            devices = {}
+            for device_address in self.pending_uploads:
+                device_data = data_parser.device_data.get(device_address)
+                if device_data is None:
+                    continue
+
+                ticks = device_data.pop('ticks_ms', None)
+                if ticks is not None and time_sync.timestamp(ticks) is not None:
+                    device_data['timestamp'] = time_sync.timestamp(ticks)
+
+                devices[device_address] = [device_data, data_parser.cell_voltages.get(device_address)]
+
+            carry['devices'] = devices
+
+        rtc_state.set('carry', carry)
+
+    def restore_state(self):
+        carry = rtc_state.get('carry')
+        if carry is None:
+            return
 
-        utime.sleep(pause_delay)
+        rtc_state.set('carry', None)
+        rtc_state.save()
 
-    def update_bluetooth(self):
+        self.logger.output('Restoring state from before deep sleep...')
+
+        radio.metrics = carry.get('radio', {})
+
+        if self.sensor is not None and carry.get('reading') is not None:
+            self.sensor.reading = carry['reading']
+
+        if self.with_bluetooth:
+            self.bluetooth_cursor = carry.get('cursor', 0) if carry.get('cursor', 0) < len(self.bluetooth_devices) else 0
+
+            for device_address, (device_data, cell_voltages) in carry.get('devices', {}).items():
+                self.bluetooth_state.data_parser.device_data[device_address] = device_data
+
+                if cell_voltages is not None:
+                    self.bluetooth_state.data_parser.cell_voltages[device_address] = cell_voltages
+
+                self.pending_uploads.append(device_address)
+
+    def send_diagnostics(self, task: Task):
+        self.diagnostics.send()
+
+    def flush_cache(self, task: Task):
+        try:
+            cache_store.flush()
+
+        except OSError as e:
+            self.logger.warning('OSError flushing cache: %s', e)
+
+            recovery.failure(SUBSYSTEM_STORAGE, e)
+
+    def ship_logs(self, task: Task):
+        self.log_shipper.send()
+
+    def update_bluetooth(self, task: Task):
         self.logger.output('Updating Bluetooth devices...')
 
         self.bluetooth_state.start()
 
-        self.bluetooth_state.scan()
+        # Only scan at the start of a sweep, a sweep resumed after its budget ran out reuses the scan results.
+        # The results are lost when the stack is reinitialized or the device wakes from deep sleep mid-sweep.
+        if self.bluetooth_cursor == 0 or not self.bluetooth_state.devices:
+            heap.begin(PHASE_SCAN)
+            started_at = trace.begin()
 
-        wait_for(lambda: self.bluetooth_state.state != STATE_SCANNING, timeout=15, on_timeout=lambda: self.logger.output('Timeout waiting for scan, stopping scan.'))
+            self.bluetooth_state.scan()
+
+            wait_for(lambda: self.bluetooth_state.state != STATE_SCANNING, timeout=15, on_timeout=lambda: self.logger.output('Timeout waiting for scan, stopping scan.'))
+
+            heap.end(PHASE_SCAN)
+            trace.end(PHASE_SCAN, started_at)
+
+        while self.bluetooth_cursor < len(self.bluetooth_devices):
+            if task.budget_exceeded():
+                self.logger.output(f'Bluetooth budget spent, resuming at device {self.bluetooth_cursor}.')
+
+                task.run_in(1)
+
+                return
+
+            recovery.feed()
+
+            device_address = self.bluetooth_devices[self.bluetooth_cursor]
+
+            self.bluetooth_cursor += 1
 
-        for device_address in self.bluetooth_devices:
             if device_address not in self.bluetooth_state.devices:
                 self.logger.output(f'Device {device_address} not found, skipping.')
 
@@ -142,90 +412,195 @@ class MonitorDevice:
 
             self.logger.output(f'Updating device {device_address}...')
 
-            self.bluetooth_state.connect(device_address)
+            gc_policy.enter_critical()
 
-            connection_state = wait_for(
-                lambda: self.bluetooth_state.state in [STATE_DISCONNECTED, STATE_READY],
-                timeout=15,
-                on_timeout=lambda: self.logger.output(f'Timeout waiting for connection... | Device state: {self.bluetooth_state.state}')
-            )
+            try:
+                self.update_bluetooth_device(device_address)
 
-            if connection_state is False:
-                self.bluetooth_state.disconnect()
+            finally:
+                gc_policy.exit_critical()
 
-                continue
+            gc_policy.between_phases()
 
-            if self.bluetooth_state.state in [STATE_CONNECTED, STATE_READY]:
-                self.logger.output('Connected and ready!')
+        self.bluetooth_cursor = 0
 
-                self.bluetooth_state.fetch_data()
+        # Have the readings uploaded as soon as the sweep has completed
+        upload_task = self.scheduler.get('upload')
+        if upload_task is not None and self.pending_uploads:
+            upload_task.run_now()
 
-                wait_for(lambda: self.bluetooth_state.state == STATE_IDLE, timeout=15, on_timeout=lambda: self.logger.output('Timeout waiting for communication...'))
+    def update_bluetooth_device(self, device_address: str):
+        self.bluetooth_state.connect(device_address)
 
-                self.bluetooth_state.disconnect()
+        connection_state = wait_for(
+            lambda: self.bluetooth_state.state in [STATE_DISCONNECTED, STATE_READY],
+            timeout=15,
+            on_timeout=lambda: self.logger.output(f'Timeout waiting for connection... | Device state: {self.bluetooth_state.state}')
+        )
 
-                self.bluetooth_state.save_data(device_address)
+        radio.ble_connect(connection_state is not False and self.bluetooth_state.state in [STATE_CONNECTED, STATE_READY])
 
-                self.last_updated[device_address] = utime.time()
+        if connection_state is False:
+            self.bluetooth_state.disconnect()
 
-            gc.collect()
+            return
 
-    def check_for_updates(self):
-        if self.config.auto_update_enabled and self.config.update_github_repo:
+        if self.bluetooth_state.state in [STATE_CONNECTED, STATE_READY]:
+            self.logger.output('Connected and ready!')
 
-            now = utime.time()
-            if now - self.config.last_update_check < 3600 and now - self.config.last_update_config_check < 3600:
-                return
+            # Drop the previous reading so a failed fetch is not uploaded again as a new one
+            self.bluetooth_state.data_parser.device_data.pop(device_address, None)
 
-            try:
-                from lib.sensor_updater import SensorUpdater
+            heap.begin(PHASE_FETCH)
+            started_at = trace.begin()
 
-                has_updated = SensorUpdater(self.config, self.logger).install_update_if_available(self.wifi.mac_address)
+            self.bluetooth_state.fetch_data()
 
-                if has_updated:
-                    self.logger.output('Update installed, restarting device...')
+            wait_for(lambda: self.bluetooth_state.state == STATE_IDLE, timeout=15, on_timeout=lambda: self.logger.output('Timeout waiting for communication...'))
 
-                    machine.reset()
+            heap.end(PHASE_FETCH)
+            trace.end(PHASE_FETCH, started_at, trace.device(device_address))
 
-            except OSError as e:
-                self.logger.output(f'OSError checking for updates: {e}')
-                if self.debug:
-                    sys.print_exception(e)
+            self.bluetooth_state.disconnect()
 
-                machine.reset()
+            if device_address not in self.bluetooth_state.data_parser.device_data and self.bluetooth_state.used_handle_hints:
+                self.bluetooth_state.forget_handles(device_address)
 
-            except Exception as e:
-                self.logger.output(f'Error checking for updates: {e}')
-                if self.debug:
-                    sys.print_exception(e)
+            self.bluetooth_state.save_handle_hints()
 
-                machine.reset()
+            if device_address in self.bluetooth_state.data_parser.device_data:
+                self.bluetooth_state.data_parser.device_data[device_address]['ticks_ms'] = clock.ticks_ms()
 
-            gc.collect()
+                if device_address not in self.pending_uploads:
+                    self.pending_uploads.append(device_address)
 
-            utime.sleep(1)
+                self.last_updated[device_address] = clock.ticks_ms()
 
-    def check_config_update(self):
-        if self.config.auto_update_enabled is False:
+                recovery.success(SUBSYSTEM_BLUETOOTH)
+
+    # Runs in slices between the monitoring tasks, only activating a downloaded release needs a restart
+    def check_for_updates(self, task: Task):
+        if not self.config.auto_update_enabled or not self.config.update_github_repo:
             return
 
-        now = utime.time()
-        if now - self.config.last_update_config_check < 3600:
-            self.logger.output('Skipping config update check, last checked less than an hour ago.')
+        from lib.sensor_updater import SensorUpdater
+
+        if self.updater is None:
+            if 0 <= clock.time() - self.config.last_update_check < self.config.update_check_interval and not SensorUpdater.has_pending_job():
+                return
+
+            self.updater = SensorUpdater(self.config, self.logger)
+
+        try:
+            if self.updater.run_slice(task):
+                self.logger.output('Update installed, restarting device...')
+
+                recovery.reset('update')
+
+        except Exception as e:
+            self.logger.warning('Error checking for updates: %s', e)
+            if self.debug:
+                sys.print_exception(e)
+
+        if not self.updater.is_running:
+            # Nothing to download, free the updater until the next check
+            self.updater = None
+
+            gc_policy.between_phases()
+
+    def check_config_update(self, task: Task | None = None):
+        if self.config.auto_update_enabled is False or self.config.auto_update_config_enabled is False:
+            return
+
+        # A clock behind the last check has not been synced yet, the check is not held back until it is
+        if 0 <= clock.time() - self.config.last_update_config_check < self.config.config_check_interval:
+            self.logger.output(f'Skipping config update check, last checked less than {self.config.config_check_interval}s ago.')
 
             return
 
-        last_updated = self.sensor.get_config_last_updated_at()
-        if last_updated is None:
-            self.logger.output('No config last updated timestamp retrieved, skipping config update check.')
+        if self.config_sync.sync():
+            self.reload_config()
+
+    def reload_config(self):
+        try:
+            config = Config.from_json_file('config.json')
+
+        except Exception as e:
+            self.logger.error('Error loading updated config: %s', e)
+
+            recovery.reset('config', e)
+
+            return
 
+        changed = self.config.changed_attributes(config)
+        if not changed:
             return
 
-        if last_updated > self.config.last_updated:
-            self.logger.output('Configuration file has been updated remotely, restarting to load new configuration...')
+        self.logger.info('Config changed: %s', lambda: ', '.join(changed))
+
+        for key in changed:
+            if key in RESET_ATTRIBUTES:
+                self.logger.output(f'Configuration change to {key} needs a restart, restarting to load new configuration...')
+
+                recovery.reset('config')
+
+                return
+
+        self.apply_config(config)
+
+    def apply_config(self, config: Config):
+        self.config = config
+        self.debug = config.debug
+        self.reset_seconds = config.reset_seconds
+        self.with_temperature_sensor = config.temperature_sensor_enabled
+        self.with_water_sensor = config.water_sensor_enabled
+
+        logger.set_level(DEBUG if self.debug else LEVELS.get(config.log_level, WARNING))
+
+        if config.log_enabled:
+            logger.set_sink(self.log_ring, LEVELS.get(config.log_persist_level, WARNING))
+
+        heap.enable(config.heap_diagnostics_enabled)
+        trace.enable(config.trace_enabled)
+
+        gc_policy.configure(config)
+
+        recovery.reconfigure(config)
+
+        time_sync.reconfigure(config)
+
+        power.configure(config)
+
+        radio.configure(config)
+
+        self.wifi.apply_config(config)
+
+        if self.with_bluetooth:
+            self.bluetooth_state.apply_config(config)
+
+            if self.bluetooth_devices != config.bluetooth_devices:
+                self.set_bluetooth_devices(config.bluetooth_devices)
+
+        if self.sensor is not None:
+            self.sensor.apply_config(config)
+
+        elif self.with_temperature_sensor or self.with_water_sensor:
+            self.sensor = Sensor(self.wifi, config, logger=self.logger)
+
+            recovery.register(SUBSYSTEM_SENSOR, self.sensor.reinitialize)
+
+        if self.updater is not None:
+            self.updater.config = config
+
+        # These only hold settings, so they are simply recreated
+        self.diagnostics = Diagnostics(self.wifi, config, logger=self.logger)
+        self.config_sync = ConfigSync(self.wifi, config, logger=self.logger)
+
+        if config.log_enabled:
+            from lib.log_ring import LogShipper
 
-            machine.reset()
+            self.log_shipper = LogShipper(self.log_ring, self.wifi, config, logger=self.logger)
 
-        self.config.update_cache('last_updated_config_check', now)
+        self.schedule_tasks()
 
-        gc.collect()
+        self.logger.output('Configuration applied without a restart.')
@@ -0,0 +1,14 @@
+from micropython import const
+
+PHASE_SCAN = const(0)
+PHASE_CONNECT = const(1)
+PHASE_DISCOVER = const(2)
+PHASE_FETCH = const(3)
+PHASE_PARSE = const(4)
+PHASE_UPLOAD = const(5)
+PHASE_CONFIG_CHECK = const(6)
+PHASE_WIFI_CHECK = const(7)
+PHASE_SAMPLE = const(8)
+PHASE_WIFI_CONNECT = const(9)
+
+PHASE_NAMES = ('scan', 'connect', 'discover', 'fetch', 'parse', 'upload', 'config_check', 'wifi_check', 'sample', 'wifi_connect')
@@ -0,0 +1,87 @@
+from lib.clock import clock
+from lib.logger import logger
+from lib.rtc_state import rtc_state
+
+MODE_AWAKE = 'awake'
+MODE_LIGHT = 'light'
+MODES = (MODE_AWAKE, MODE_LIGHT)
+
+# Decides how the device sleeps between tasks, and whether it sleeps through the night
+class PowerManager:
+    mode: str = MODE_AWAKE
+    min_light_sleep_ms: int = 1000
+    deep_sleep_start_hour: int | None = None
+    deep_sleep_end_hour: int | None = None
+    handlers: list[callable] = []
+
+    def __init__(self):
+        self.handlers = []
+
+    def configure(self, config):
+        self.mode = config.power_mode if config.power_mode in MODES else MODE_AWAKE
+        self.min_light_sleep_ms = config.power_min_light_sleep_ms
+        self.deep_sleep_start_hour = config.power_deep_sleep_start_hour
+        self.deep_sleep_end_hour = config.power_deep_sleep_end_hour
+
+    @property
+    def deep_sleep_enabled(self) -> bool:
+        return self.deep_sleep_start_hour is not None and self.deep_sleep_end_hour is not None
+
+    # Handlers run right before deep sleep, to move what has to survive it into RTC memory
+    def before_deep_sleep(self, handler: callable):
+        self.handlers.append(handler)
+
+    def sleep_ms(self, delay_ms: int):
+        # Light sleep powers the radios down, it is only worth it for the longer gaps between tasks
+        if self.mode == MODE_LIGHT and delay_ms >= self.min_light_sleep_ms:
+            clock.lightsleep_ms(delay_ms)
+        else:
+            clock.sleep_ms(delay_ms)
+
+    def deep_sleep_seconds(self) -> int:
+        from lib.time_sync import time_sync
+
+        # Without the time of day the night cannot be told apart from the day
+        if not self.deep_sleep_enabled or not (clock.simulated or time_sync.is_synced):
+            return 0
+
+        tm = clock.localtime()
+        now = tm[3] * 3600 + tm[4] * 60 + tm[5]
+        start = self.deep_sleep_start_hour * 3600
+        end = self.deep_sleep_end_hour * 3600
+
+        # The window may span midnight, e.g. from 22 to 6
+        is_in_window = start <= now < end if start < end else now >= start or now < end
+        if not is_in_window:
+            return 0
+
+        return (end - now) % 86400
+
+    def deep_sleep(self, seconds: int):
+        from lib.cache_store import cache_store
+
+        logger.warning('Deep sleeping for %ds', seconds)
+
+        for handler in self.handlers:
+            try:
+                handler()
+
+            except Exception as e:
+                logger.error('Error preparing for deep sleep: %s', e)
+
+        try:
+            rtc_state.save()
+
+        except (OSError, ValueError) as e:
+            # RTC memory is small, the carried readings are the first to go
+            logger.warning('RTC state too large, dropping carried readings: %s', e)
+
+            rtc_state.set('carry', None)
+            rtc_state.save()
+
+        cache_store.flush()
+        logger.flush()
+
+        clock.deepsleep_ms(seconds * 1000)
+
+power = PowerManager()
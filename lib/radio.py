@@ -0,0 +1,135 @@
+from lib.clock import clock
+
+RADIO_WIFI = 'wifi'
+RADIO_BLE = 'ble'
+
+# shared: WiFi and Bluetooth interleave as they please, as before
+# windows: WiFi work waits for the end of a Bluetooth window, and WiFi is put in power save during one
+POLICY_SHARED = 'shared'
+POLICY_WINDOWS = 'windows'
+POLICIES = (POLICY_SHARED, POLICY_WINDOWS)
+
+# Per policy counters, in the order they are reported
+BLE_CONNECTS = 0
+BLE_FAILURES = 1
+HTTP_REQUESTS = 2
+HTTP_FAILURES = 3
+HTTP_MS_TOTAL = 4
+HTTP_MS_MAX = 5
+
+# The ESP32-C3 has one radio for both WiFi and Bluetooth. The arbiter decides which of them may be used,
+# the WLAN and BLE objects are passed in so a policy can be checked against stand-ins off the device.
+class RadioArbiter:
+    wlan = None
+    ble = None
+    connect: callable = None
+    policy: str = POLICY_WINDOWS
+    max_ble_window_ms: int = 120000
+    window: str | None = None
+    window_started: int = 0
+    metrics: dict[str, list[int]] = {}
+
+    def __init__(self, wlan=None, ble=None, *, policy: str = POLICY_WINDOWS, max_ble_window_ms: int = 120000):
+        self.wlan = wlan
+        self.ble = ble
+        self.connect = None
+        self.policy = policy
+        self.max_ble_window_ms = max_ble_window_ms
+        self.window = None
+        self.window_started = 0
+        self.metrics = {}
+
+    def attach(self, wlan, ble, connect: callable | None = None):
+        self.wlan = wlan
+        self.ble = ble
+        self.connect = connect
+
+    def configure(self, config):
+        policy = config.radio_policy if config.radio_policy in POLICIES else POLICY_WINDOWS
+
+        # Leave an open window the way the new policy would have left it
+        if policy != self.policy and self.window == RADIO_BLE:
+            self.set_power_save(policy == POLICY_WINDOWS)
+
+        self.policy = policy
+        self.max_ble_window_ms = config.radio_max_ble_window_seconds * 1000
+
+    def begin_ble(self):
+        if self.window == RADIO_BLE:
+            return
+
+        self.window = RADIO_BLE
+        self.window_started = clock.ticks_ms()
+
+        if self.policy == POLICY_WINDOWS:
+            self.set_power_save(True)
+
+    def end_ble(self):
+        if self.window != RADIO_BLE:
+            return
+
+        self.window = None
+
+        if self.policy == POLICY_WINDOWS:
+            # A scan which outlived its wait would keep the radio from WiFi
+            if self.ble is not None and self.ble.active():
+                self.ble.gap_scan(None)
+
+            self.set_power_save(False)
+
+    def allows(self, radio: str | None) -> bool:
+        if radio != RADIO_WIFI or self.window != RADIO_BLE or self.policy != POLICY_WINDOWS:
+            return True
+
+        # A sweep which never finishes must not hold WiFi back for good
+        if clock.ticks_diff(clock.ticks_ms(), self.window_started) > self.max_ble_window_ms:
+            self.end_ble()
+
+            return True
+
+        return False
+
+    def prepare(self, radio: str | None):
+        # WiFi does not stay associated through light sleep, so it is reconnected when a task needs it
+        if radio == RADIO_WIFI and self.connect is not None and self.wlan is not None and not self.wlan.isconnected():
+            self.connect()
+
+    def set_power_save(self, enabled: bool):
+        if self.wlan is None:
+            return
+
+        try:
+            # Bluetooth needs modem sleep while WiFi is connected, so the lightest setting is PM_PERFORMANCE
+            self.wlan.config(pm=self.wlan.PM_POWERSAVE if enabled else self.wlan.PM_PERFORMANCE)
+
+        except (AttributeError, OSError, ValueError):
+            pass
+
+    def counters(self) -> list[int]:
+        counters = self.metrics.get(self.policy)
+        if counters is None:
+            counters = [0, 0, 0, 0, 0, 0]
+            self.metrics[self.policy] = counters
+
+        return counters
+
+    def ble_connect(self, is_connected: bool):
+        counters = self.counters()
+        counters[BLE_CONNECTS] += 1
+
+        if not is_connected:
+            counters[BLE_FAILURES] += 1
+
+    def http_request(self, duration_ms: int, is_ok: bool):
+        counters = self.counters()
+        counters[HTTP_REQUESTS] += 1
+        counters[HTTP_MS_TOTAL] += duration_ms
+        counters[HTTP_MS_MAX] = max(counters[HTTP_MS_MAX], duration_ms)
+
+        if not is_ok:
+            counters[HTTP_FAILURES] += 1
+
+    def summary(self) -> dict[str, list[int]]:
+        return self.metrics
+
+radio = RadioArbiter()
@@ -0,0 +1,201 @@
+import machine
+
+from lib.clock import clock
+from lib.logger import logger
+from lib.rtc_state import rtc_state
+
+SUBSYSTEM_HTTP = 'http'
+SUBSYSTEM_WIFI = 'wifi'
+SUBSYSTEM_BLUETOOTH = 'bluetooth'
+SUBSYSTEM_SENSOR = 'sensor'
+SUBSYSTEM_STORAGE = 'storage'
+
+ERROR_TIMEOUT = 116
+
+# Failures escalate per subsystem: retry with backoff, then reinitialize the subsystem, then hard reset
+class Recovery:
+    config = None
+    retries: int = 2
+    backoff_ms: int = 500
+    reinit_attempts: int = 2
+    failures: dict[str, int] = {}
+    reinits: dict[str, callable] = {}
+    observers: dict[str, callable] = {}
+    pending: dict[str, int] = {}
+    watchdog = None
+
+    def __init__(self):
+        self.failures = {}
+        self.reinits = {}
+        self.observers = {}
+        self.pending = {}
+        self.watchdog = None
+
+    def configure(self, config):
+        from lib import fastboot
+
+        self.reconfigure(config)
+
+        cause = {
+            machine.WDT_RESET: 'watchdog',
+            machine.HARD_RESET: 'hard',
+        }.get(machine.reset_cause())
+
+        # A reset through reset() was counted with its own cause before it happened
+        if cause == 'hard' and fastboot.planned_reset is not None:
+            cause = None
+
+        if cause is not None:
+            self.count_restart(cause)
+
+            # In a reset loop the periodic flush would never come around
+            self.flush_cache()
+
+        if config.watchdog_seconds > 0:
+            self.start_watchdog(config.watchdog_seconds * 1000)
+
+    def reconfigure(self, config):
+        self.config = config
+        self.retries = config.recovery_retries
+        self.backoff_ms = config.recovery_backoff_ms
+        self.reinit_attempts = config.recovery_reinit_attempts
+
+    def start_watchdog(self, timeout_ms: int):
+        logger.output(f'Starting watchdog with {timeout_ms}ms timeout')
+
+        self.watchdog = machine.WDT(timeout=timeout_ms)
+
+    def feed(self):
+        if self.watchdog is not None:
+            self.watchdog.feed()
+
+    @property
+    def watchdog_timeout_ms(self) -> int:
+        if self.watchdog is None or self.config is None:
+            return 0
+
+        return self.config.watchdog_seconds * 1000
+
+    @property
+    def restart_counts(self) -> dict[str, int]:
+        return self.config.restart_counts if self.config is not None else {}
+
+    def register(self, subsystem: str, reinit: callable):
+        self.reinits[subsystem] = reinit
+
+    # The observer is called with the duration in ms and whether it succeeded, for every attempt of a call
+    def observe(self, subsystem: str, observer: callable):
+        self.observers[subsystem] = observer
+
+    def success(self, subsystem: str):
+        if self.failures.get(subsystem):
+            self.failures[subsystem] = 0
+
+    def call(self, subsystem: str, func: callable, *args, **kwargs):
+        observer = self.observers.get(subsystem)
+
+        attempt = 0
+        while True:
+            started_at = clock.ticks_ms()
+
+            try:
+                result = func(*args, **kwargs)
+
+                if observer is not None:
+                    observer(clock.ticks_diff(clock.ticks_ms(), started_at), True)
+
+                self.success(subsystem)
+
+                return result
+
+            except OSError as e:
+                if observer is not None:
+                    observer(clock.ticks_diff(clock.ticks_ms(), started_at), False)
+
+                attempt += 1
+
+                # A timeout has already waited long enough, so it goes straight to the next tier
+                if attempt > self.retries or e.args[0] in (ERROR_TIMEOUT, -ERROR_TIMEOUT):
+                    self.failure(subsystem, e)
+
+                    raise
+
+                delay_ms = self.backoff_ms << (attempt - 1)
+
+                logger.info('OSError in %s: %s, retrying in %dms...', subsystem, e, delay_ms)
+
+                self.feed()
+
+                clock.sleep_ms(delay_ms)
+
+    def failure(self, subsystem: str, error):
+        count = self.failures.get(subsystem, 0) + 1
+        self.failures[subsystem] = count
+
+        if count > self.reinit_attempts:
+            self.reset(subsystem, error)
+
+            return
+
+        logger.warning('Failure %d in %s: %s', count, subsystem, error)
+
+        if subsystem in self.reinits:
+            # Reinitialization runs from the scheduler loop, never from inside the failing call or an IRQ
+            self.pending[subsystem] = count
+
+    def process(self):
+        while self.pending:
+            subsystem, count = self.pending.popitem()
+
+            logger.warning('Reinitializing %s (attempt %d)...', subsystem, count)
+
+            try:
+                self.reinits[subsystem](count)
+
+            except OSError as e:
+                self.failure(subsystem, e)
+
+            except Exception as e:
+                logger.error('Error reinitializing %s: %s', subsystem, e)
+
+    def count_restart(self, cause: str):
+        if self.config is None:
+            return
+
+        try:
+            restart_counts = self.config.restart_counts.copy()
+            restart_counts[cause] = restart_counts.get(cause, 0) + 1
+
+            self.config.update_cache('restart_counts', restart_counts)
+
+        except Exception as e:
+            logger.error('Error recording restart cause: %s', e)
+
+    def reset(self, cause: str, error=None):
+        logger.error('Restarting device, cause: %s %s', cause, error if error is not None else '')
+
+        self.count_restart(cause)
+        self.flush_cache()
+
+        logger.flush()
+
+        # The next boot is told this was planned, so it neither waits out the grace period nor counts a hard reset
+        try:
+            rtc_state.set('planned_reset', cause)
+            rtc_state.save()
+
+        except Exception as e:
+            logger.error('Error marking planned reset: %s', e)
+
+        machine.reset()
+
+    def flush_cache(self):
+        try:
+            from lib.cache_store import cache_store
+
+            cache_store.flush()
+
+        except Exception as e:
+            logger.error('Error flushing cache: %s', e)
+
+recovery = Recovery()
@@ -0,0 +1,32 @@
+import machine
+import ujson as json
+
+# Small key/value store kept in RTC memory, which survives soft, watchdog and deep-sleep resets but not power loss
+class RTCState:
+    data: dict = {}
+
+    def __init__(self):
+        self.rtc = machine.RTC()
+        self.data = {}
+
+        self.load()
+
+    def load(self):
+        try:
+            memory = self.rtc.memory()
+            if memory:
+                self.data = json.loads(memory)
+
+        except Exception:
+            self.data = {}
+
+    def get(self, key: str, default=None):
+        return self.data.get(key, default)
+
+    def set(self, key: str, value):
+        self.data[key] = value
+
+    def save(self):
+        self.rtc.memory(json.dumps(self.data))
+
+rtc_state = RTCState()
@@ -0,0 +1,191 @@
+from lib.clock import clock
+from lib.gc_policy import gc_policy
+from lib.logger import Logger
+from lib.power import power
+from lib.radio import radio
+from lib.recovery import recovery
+
+class Task:
+    name: str
+    callback: callable
+    interval: int | callable
+    deadline: int
+    budget_ms: int
+    next_run: int
+    started_at: int
+    last_duration_ms: int
+    runs: int
+    late_runs: int
+    overruns: int
+    enabled: bool
+    radio: str | None
+
+    def __init__(self, name: str, callback: callable, *, interval: int | callable, deadline: int = 0, budget_ms: int = 0, delay: int = 0, radio: str | None = None):
+        self.name = name
+        self.callback = callback
+        self.interval = interval
+        self.deadline = deadline
+        self.budget_ms = budget_ms
+        self.next_run = clock.ticks_add(clock.ticks_ms(), delay * 1000)
+        self.started_at = 0
+        self.last_duration_ms = 0
+        self.runs = 0
+        self.late_runs = 0
+        self.overruns = 0
+        self.enabled = True
+        self.radio = radio
+
+    @property
+    def period(self) -> int:
+        return self.interval() if callable(self.interval) else self.interval
+
+    def due_in_ms(self, now: int) -> int:
+        return clock.ticks_diff(self.next_run, now)
+
+    def deadline_in_ms(self, now: int) -> int:
+        return self.due_in_ms(now) + self.deadline * 1000
+
+    def budget_remaining_ms(self) -> int:
+        if self.budget_ms <= 0:
+            return 0x3fffffff
+
+        return self.budget_ms - clock.ticks_diff(clock.ticks_ms(), self.started_at)
+
+    def budget_exceeded(self) -> bool:
+        return self.budget_remaining_ms() <= 0
+
+    @property
+    def is_runnable(self) -> bool:
+        # Tasks which need a radio the arbiter is holding back wait for it, however overdue
+        return self.enabled and radio.allows(self.radio)
+
+    def run_now(self):
+        self.next_run = clock.ticks_ms()
+
+    def run_in(self, seconds: int | float):
+        self.next_run = clock.ticks_add(clock.ticks_ms(), int(seconds * 1000))
+
+class Scheduler:
+    tasks: list[Task] = []
+    logger: Logger
+    max_sleep_ms: int = 60000
+
+    def __init__(self, logger: Logger, *, max_sleep_ms: int = 60000):
+        self.logger = logger
+        self.tasks = []
+        self.max_sleep_ms = max_sleep_ms
+
+    def add(self, task: Task) -> Task:
+        self.tasks.append(task)
+
+        return task
+
+    # Adds the task the first time, later calls only update its interval and whether it runs
+    def schedule(self, name: str, callback: callable, *, enabled: bool = True, interval: int | callable, **kwargs) -> Task | None:
+        task = self.get(name)
+        if task is None:
+            if not enabled:
+                return None
+
+            return self.add(Task(name, callback, interval=interval, **kwargs))
+
+        task.interval = interval
+        task.enabled = enabled
+
+        # A shorter interval applies straight away instead of after the current one
+        if enabled and task.due_in_ms(clock.ticks_ms()) > task.period * 1000:
+            task.run_in(task.period)
+
+        return task
+
+    def get(self, name: str) -> Task | None:
+        for task in self.tasks:
+            if task.name == name:
+                return task
+
+        return None
+
+    def next_task(self, now: int) -> Task | None:
+        # Earliest deadline first among the tasks which are already due
+        next_task = None
+        for task in self.tasks:
+            if not task.is_runnable or task.due_in_ms(now) > 0:
+                continue
+
+            if next_task is None or task.deadline_in_ms(now) < next_task.deadline_in_ms(now):
+                next_task = task
+
+        return next_task
+
+    def run_task(self, task: Task):
+        now = clock.ticks_ms()
+
+        if task.deadline > 0 and task.deadline_in_ms(now) < 0:
+            task.late_runs += 1
+
+            self.logger.output(f'Task {task.name} started {-task.due_in_ms(now)}ms late (deadline {task.deadline}s)')
+
+        # Reschedule before running so a task may override its own next run
+        task.next_run = clock.ticks_add(now, task.period * 1000)
+        task.started_at = now
+
+        recovery.feed()
+
+        # Brings the radio back up if light sleep or the arbiter has taken it down
+        radio.prepare(task.radio)
+
+        task.callback(task)
+
+        task.runs += 1
+        task.last_duration_ms = clock.ticks_diff(clock.ticks_ms(), now)
+
+        if task.budget_ms > 0 and task.last_duration_ms > task.budget_ms:
+            task.overruns += 1
+
+            self.logger.output(f'Task {task.name} took {task.last_duration_ms}ms (budget {task.budget_ms}ms)')
+
+    def run_pending(self):
+        while True:
+            task = self.next_task(clock.ticks_ms())
+            if task is None:
+                return
+
+            self.run_task(task)
+
+            gc_policy.between_phases()
+
+    def sleep_until_next(self):
+        now = clock.ticks_ms()
+
+        delay_ms = self.max_sleep_ms
+        for task in self.tasks:
+            if task.is_runnable:
+                delay_ms = min(delay_ms, task.due_in_ms(now))
+
+        if delay_ms > 0:
+            self.sleep_ms(delay_ms)
+
+    def sleep_ms(self, delay_ms: int):
+        # Sleep in slices so the watchdog is fed well within its timeout
+        watchdog_timeout_ms = recovery.watchdog_timeout_ms
+        while delay_ms > 0:
+            recovery.feed()
+
+            slice_ms = min(delay_ms, watchdog_timeout_ms // 2) if watchdog_timeout_ms > 0 else delay_ms
+
+            power.sleep_ms(slice_ms)
+
+            delay_ms -= slice_ms
+
+        recovery.feed()
+
+    # Runs forever on the device, a simulated clock can run it for a set time instead
+    def run(self, duration_ms: int | None = None):
+        started_at = clock.ticks_ms()
+
+        while duration_ms is None or clock.ticks_diff(clock.ticks_ms(), started_at) < duration_ms:
+            self.run_pending()
+
+            recovery.process()
+
+            self.sleep_until_next()
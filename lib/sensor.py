@@ -1,11 +1,16 @@
-import gc
-import machine
 from machine import Pin, I2C
 import requests
 import sys
 
+from lib.clock import clock
 from lib.config import Config
+from lib.gc_policy import gc_policy
+from lib.heap import heap
 from lib.logger import Logger
+from lib.phases import PHASE_UPLOAD
+from lib.time_sync import time_sync
+from lib.trace import trace
+from lib.recovery import recovery, SUBSYSTEM_HTTP, SUBSYSTEM_SENSOR
 from thirdparty.ahtx0.ahtx0 import AHT10
 from wifi import WifiHandler
 
@@ -14,6 +19,8 @@ class Sensor:
     water_sensor: Pin | None = None
     debug: bool = False
     logger: Logger
+    reading: dict | None = None
+    reading_ticks: int = 0
 
     def __init__(self, wifi: WifiHandler, config: Config, logger: Logger):
         self.debug = config.debug
@@ -21,7 +28,6 @@ class Sensor:
         self.api_url = config.api_url
         self.api_endpoint = config.sensor_endpoint
         self.config_api_endpoint = config.sensor_config_endpoint
-        self.config_last_updated_api_endpoint = config.sensor_config_last_updated_endpoint
         self.api_token = config.api_token
         self.water_sensor = None
         self.temperature_sensor = None
@@ -32,10 +38,23 @@ class Sensor:
         self.temperature_sensor_sda_pin = config.temperature_sensor_sda_pin
         self.water_sensor_in_pin = config.water_sensor_in_pin
         self.water_sensor_out_pin = config.water_sensor_out_pin
+        self.reading = None
 
         if self.with_water_sensor:
             self.setup_water_sensor()
 
+    def apply_config(self, config: Config):
+        self.debug = config.debug
+        self.api_url = config.api_url
+        self.api_endpoint = config.sensor_endpoint
+        self.config_api_endpoint = config.sensor_config_endpoint
+        self.api_token = config.api_token
+        self.with_temperature_sensor = config.temperature_sensor_enabled
+        self.with_water_sensor = config.water_sensor_enabled
+
+        if self.with_water_sensor and self.water_sensor is None:
+            self.setup_water_sensor()
+
     @property
     def is_wet(self) -> bool:
         return self.water_sensor.value() == 1
@@ -63,13 +82,20 @@ class Sensor:
             return self.temperature_sensor
 
         except OSError as e:
-            self.logger.output(f'OSError initializing temperature sensor: {e}')
+            self.logger.warning('OSError initializing temperature sensor: %s', e)
 
-            machine.reset()
+            recovery.failure(SUBSYSTEM_SENSOR, e)
 
         except Exception as e:
-            self.logger.output(f'Error initializing sensor: {e}')
-            return None
+            self.logger.warning('Error initializing sensor: %s', e)
+
+        return None
+
+    def reinitialize(self, attempt: int = 1):
+        self.temperature_sensor = None
+
+        if self.with_water_sensor:
+            self.setup_water_sensor()
 
     def setup_water_sensor(self):
         self.water_sensor = Pin(
@@ -84,91 +110,79 @@ class Sensor:
             value=1,
         )
 
-    def update_data(self):
-        self.logger.output('Updating sensor...')
-
-        try:
-            response = requests.post(
-                f'{self.api_url}/{self.api_endpoint}',
-                headers={
-                    'Authorization': f'Bearer {self.api_token}',
-                    'Content-Type': 'application/json',
-                },
-                json={
-                    "address": self.wifi.mac_address,
-                    "temperature": self.temperature if self.with_temperature_sensor else None,
-                    "humidity": self.humidity if self.with_temperature_sensor else None,
-                    "is_wet": self.is_wet if self.with_water_sensor else None,
-                },
-                timeout=10,
-            )
+    def sample(self):
+        self.logger.output('Sampling sensor...')
 
-            self.logger.output('Data sent successfully:', response.status_code, response.content)
+        self.reading = {
+            "address": self.wifi.mac_address,
+            "temperature": self.temperature if self.with_temperature_sensor else None,
+            "humidity": self.humidity if self.with_temperature_sensor else None,
+            "is_wet": self.is_wet if self.with_water_sensor else None,
+        }
 
-            response.close()
+        self.reading_ticks = clock.ticks_ms()
 
-            del response
+        if recovery.restart_counts:
+            self.reading['restarts'] = recovery.restart_counts
 
-            gc.collect()
+        if heap.enabled:
+            self.reading['heap'] = heap.summary()
+            self.reading['gc'] = gc_policy.stats()
 
-        except OSError as e:
-            if str(e.args[0]) != '-116':
-                self.logger.output(f'OSError sending sensor data: {e}')
-                if self.debug:
-                    sys.print_exception(e)
+    # True only once the server has accepted the reading
+    def update_data(self) -> bool:
+        if self.reading is None:
+            return False
 
-                machine.reset()
+        self.logger.output('Updating sensor...')
 
-        except Exception as e:
-            self.logger.output(f'Error sending sensor data: {e}')
-            if self.debug:
-                sys.print_exception(e)
+        # Taken before the clock was synced, the reading is only stamped once it has been
+        if 'timestamp' not in self.reading:
+            timestamp = time_sync.timestamp(self.reading_ticks)
+            if timestamp is not None:
+                self.reading['timestamp'] = timestamp
 
-    def get_config_last_updated_at(self) -> int | None:
-        self.logger.output('Fetching config last updated timestamp...')
+        heap.begin(PHASE_UPLOAD)
+        started_at = trace.begin()
 
         try:
-            response = requests.get(
-                f'{self.api_url}/{self.config_last_updated_api_endpoint}',
+            response = recovery.call(
+                SUBSYSTEM_HTTP,
+                requests.post,
+                f'{self.api_url}/{self.api_endpoint}',
                 headers={
                     'Authorization': f'Bearer {self.api_token}',
                     'Content-Type': 'application/json',
                 },
-                json={
-                    "address": self.wifi.mac_address,
-                },
+                json=self.reading,
                 timeout=10,
             )
 
-            last_updated_at = None
-            if response.status_code == 200:
-                json_response = response.json()
-                last_updated_at = json_response.get('config_updated_at')
-
-                del json_response
-
-                self.logger.output('Config last updated at:', last_updated_at)
+            self.logger.output('Data sent successfully:', response.status_code, response.content)
 
-            else:
-                self.logger.output('Failed to fetch config last updated timestamp')
+            is_accepted = 200 <= response.status_code < 300
 
             response.close()
 
             del response
 
-            return last_updated_at
+            self.reading = None
 
-        except OSError as e:
-            if str(e.args[0]) != '-116':
-                self.logger.output(f'OSError determining whether config needs updating: {e}')
-                if self.debug:
-                    sys.print_exception(e)
+            heap.end(PHASE_UPLOAD)
+            trace.end(PHASE_UPLOAD, started_at)
 
-                machine.reset()
+            gc_policy.between_phases()
+
+            return is_accepted
+
+        except OSError as e:
+            self.logger.warning('OSError sending sensor data: %s', e)
+            if self.debug:
+                sys.print_exception(e)
 
         except Exception as e:
-            self.logger.output(f'Error determining whether config needs updating: {e}')
+            self.logger.warning('Error sending sensor data: %s', e)
             if self.debug:
                 sys.print_exception(e)
 
-        return None
+        return False
@@ -1,63 +1,288 @@
 # Heavily based on https://github.com/rdehuyss/micropython-ota-updater/blob/master/app/ota_updater.py
 
+# Git blob hash of every file in a release, keyed by its path within the release
+MANIFEST_FILE = 'ota_manifest.json'
+
+# The release archive is downloaded here first, so the download can resume after a reset
+ARCHIVE_FILE = 'update.tar.gz'
+
+JOB_DOWNLOAD = 'download'
+JOB_EXTRACT = 'extract'
+JOB_FILES = 'files'
+JOB_ACTIVATE = 'activate'
+
+# Directory listings of the release being downloaded, kept with their ETag so a resumed job can revalidate them
+LISTING_CACHE_DIR = 'update_listings'
+
+def parse_version(version: str) -> tuple:
+    # Semantic versions compare numerically, so 0.10.0 sorts after 0.9.0, and a pre-release before its release
+    parts = version.lstrip('vV').split('+')[0].split('-', 1)
+    prerelease = parts[1] if len(parts) > 1 else ''
+
+    numbers = []
+    for number in parts[0].split('.'):
+        if not number.isdigit():
+            # Not a version at all, sorts before every real version
+            return ()
+
+        numbers.append(int(number))
+
+    while len(numbers) < 3:
+        numbers.append(0)
+
+    return (tuple(numbers), 0 if prerelease else 1, prerelease)
+
+def scan_json_strings(stream, key: bytes, chunk_size: int = 256):
+    # Yields the string values of a key as the response streams in, without parsing the whole document
+    pattern = b'"' + key + b'"'
+    carry = b''
+
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return
+
+        data = carry + chunk
+        position = 0
+
+        while True:
+            key_position = data.find(pattern, position)
+            if key_position < 0:
+                # The key may be split over two chunks
+                carry = data[-len(pattern):]
+
+                break
+
+            colon = data.find(b':', key_position + len(pattern))
+            start = data.find(b'"', colon + 1) if colon >= 0 else -1
+            end = data.find(b'"', start + 1) if start >= 0 else -1
+
+            if end < 0:
+                carry = data[key_position:]
+
+                break
+
+            yield data[start + 1:end].decode()
+
+            position = end + 1
+
+def get_content_range_total(headers: dict) -> int | None:
+    from lib.utils import get_header
+
+    # "Content-Range: bytes 0-32767/183412"
+    value = get_header(headers, 'Content-Range')
+    if value is None:
+        return None
+
+    total = value[value.rfind('/') + 1:].strip()
+
+    return int(total) if total.isdigit() else None
+
+# Releases are staged in the slot which is not running and activated by switching the pointer in slot.json.
+# The work is done in slices from a scheduler task, the job kept in the cache says where to continue.
 class SensorUpdater:
     def __init__(self, config, logger):
+        from slot_state import slot_state
+
         self.config = config
         self.logger = logger
+        self.slot_state = slot_state
+        self.staging_dir = slot_state.inactive
+        self.manifest = {}
+        self.new_manifest = {}
+        self.bytes_downloaded = 0
+        self.bytes_saved = 0
+        self.job = None
+        self.archive = None
+        self.archive_file = None
+        self.archive_response = None
+        self.pending_dirs = None
+        self.pending_files = []
+
+        github_src_dir = config.update_github_src_dir
+
+        self.github_repo = config.update_github_repo.rstrip('/').replace('https://github.com/', '')
+        self.github_src_dir = '/' if github_src_dir is None or len(github_src_dir.strip('/')) < 1 else '/' + github_src_dir.strip('/') + '/'
 
-    def install_update_if_available(self, mac_address: str) -> bool:
-        import utime
+    @property
+    def is_running(self) -> bool:
+        return self.job is not None
 
-        config_has_updated = self._download_config_file(mac_address)
-        if config_has_updated:
-            self.logger.output('Config file has been updated, rebooting.')
+    @staticmethod
+    def has_pending_job() -> bool:
+        from lib.config import Config
 
-            import machine
+        return Config.get_cache('update_job') is not None
 
-            machine.reset()
+    # Returns True once a new release has been activated and the device needs to restart
+    def run_slice(self, task) -> bool:
+        import sys
+        from lib.gc_policy import gc_policy
 
-        last_update_check = self.config.last_update_check
-        if utime.time() - last_update_check < 3600:
-            self.logger.output('Update check performed recently, skipping...')
+        # The inactive slot holds the release to roll back to until the running one has passed its trial
+        if self.slot_state.is_on_trial:
+            self.logger.output(f'{self.slot_state.version("")} is on trial, not updating until it is marked healthy.')
 
             return False
 
-        github_src_dir = self.config.update_github_src_dir
+        if self.job is None and not self._resume_job() and not self._start_job():
+            return False
 
-        github_repo = self.config.update_github_repo.rstrip('/').replace('https://github.com/', '')
-        github_src_dir = '/' if github_src_dir is None or len(github_src_dir) < 1 else github_src_dir.rstrip('/') + '/'
+        try:
+            while not task.budget_exceeded():
+                phase = self.job['phase']
 
-        version_check_response = self._check_for_new_version(github_repo)
-        if version_check_response is not None:
-            (current_version, latest_version) = version_check_response
-            if latest_version > current_version:
-                self.logger.output(f'New version found - {latest_version}...')
+                if phase == JOB_DOWNLOAD:
+                    if self._download_archive_slice():
+                        self._save_job(JOB_EXTRACT)
 
-                self._rmtree(self._modulepath(self.config.update_new_version_dir))
+                elif phase == JOB_EXTRACT:
+                    if self._extract_archive_slice(task):
+                        self._save_job(JOB_ACTIVATE)
 
-                self._mkdir(self._modulepath(self.config.update_new_version_dir))
+                elif phase == JOB_FILES:
+                    if self._download_files_slice(task):
+                        self._save_job(JOB_ACTIVATE)
 
-                self._download_new_version(latest_version, github_src_dir, github_repo)
-                self._install_new_version(latest_version)
+                else:
+                    self._install_new_version(self.job['version'])
 
-                import gc
+                    return True
 
-                gc.collect()
+                gc_policy.between_phases()
 
-                return True
+        except MemoryError as e:
+            self._close_archive()
 
-            self.logger.output('No new version found.')
-        else:
-            self.logger.output('Could not determine if new version is available. Pausing checks to avoid repeated failed attempts.')
+            if self.job['phase'] == JOB_EXTRACT:
+                # The gzip window needs a contiguous 32KB block, fetch the files one at a time instead
+                self.logger.warning('Not enough memory to extract release archive, downloading files individually: %s', e)
 
-        self.config.update_cache('last_update_check', utime.time())
+                self._remove_file(ARCHIVE_FILE)
+                self._clear_staging()
+
+                self._save_job(JOB_FILES)
+            else:
+                self.logger.warning('Not enough memory updating to %s, retrying later: %s', self.job['version'], e)
 
-        import gc
+                task.run_in(60)
 
-        gc.collect()
+                return False
+
+        except OSError as e:
+            # The job is kept, the next slice carries on where this one stopped
+            self.logger.warning('OSError updating to %s, retrying later: %s', self.job['version'], e)
+            if self.config.debug:
+                sys.print_exception(e)
+
+            self._close_archive()
+
+            task.run_in(60)
+
+            return False
+
+        except Exception as e:
+            self.logger.warning('Error updating to %s, abandoning update: %s', self.job['version'], e)
+            if self.config.debug:
+                sys.print_exception(e)
+
+            self._abandon_job()
+
+            return False
+
+        # More to do, continue once the other tasks have had their turn
+        task.run_in(1)
 
         return False
 
+    def _start_job(self) -> bool:
+        import utime
+
+        version_check_response = self._check_for_new_version(self.github_repo)
+
+        self.config.update_cache('last_update_check', utime.time())
+
+        if version_check_response is None:
+            self.logger.output('Could not determine if new version is available. Pausing checks to avoid repeated failed attempts.')
+
+            return False
+
+        (current_version, latest_version) = version_check_response
+        if latest_version == self.slot_state.data.get('failed_version'):
+            self.logger.output(f'Version {latest_version} was rolled back, skipping.')
+
+            return False
+
+        if not parse_version(latest_version) > parse_version(current_version):
+            self.logger.output('No new version found.')
+
+            return False
+
+        self.logger.output(f'New version found - {latest_version}...')
+
+        self._remove_file(ARCHIVE_FILE)
+        self._clear_staging()
+
+        self.job = {'version': latest_version}
+
+        self._save_job(JOB_DOWNLOAD if self.config.update_archive_enabled else JOB_FILES)
+
+        return True
+
+    def _resume_job(self) -> bool:
+        from lib.config import Config
+
+        job = Config.get_cache('update_job')
+        if job is None:
+            return False
+
+        # A job started by a release which has since been replaced or rolled back is stale
+        if job.get('slot') != self.staging_dir or job['version'] == self.slot_state.data.get('failed_version'):
+            self._abandon_job()
+
+            return False
+
+        self.logger.output(f'Resuming update to {job["version"]} ({job["phase"]})...')
+
+        self.job = job
+        self.bytes_downloaded, self.bytes_saved = job.get('stats', [0, 0])
+
+        return True
+
+    def _save_job(self, phase: str):
+        from lib.cache_store import cache_store
+
+        # Always a new dict, the cache store only marks changed values as dirty
+        self.job = {
+            'version': self.job['version'],
+            'phase': phase,
+            'slot': self.staging_dir,
+            'stats': [self.bytes_downloaded, self.bytes_saved],
+            'archive': self.job.get('archive'),
+        }
+
+        self.config.update_cache('update_job', self.job)
+
+        # Phases change a handful of times per update, written straight away so a power loss does not lose them
+        cache_store.flush()
+
+    def _finish_job(self):
+        self.job = None
+        self.pending_dirs = None
+        self.pending_files = []
+
+        self._close_archive()
+
+        self.config.update_cache('update_job', None)
+
+        self._rmtree(self._modulepath(LISTING_CACHE_DIR))
+
+    def _abandon_job(self):
+        self._finish_job()
+
+        self._remove_file(ARCHIVE_FILE)
+        self._clear_staging()
+
     @property
     def debug(self):
         return self.config.debug
@@ -73,17 +298,6 @@ class SensorUpdater:
 
         return headers
 
-    @property
-    def sensor_request_headers(self):
-        headers = {
-            'User-Agent': 'esp32-solar-sensor-updater',
-        }
-
-        if self.config.api_token is not None:
-            headers['Authorization'] = f'Bearer {self.config.api_token}'
-
-        return headers
-
     def _check_for_new_version(self, github_repo='alexbarnsley/esp32-solar-sensor'):
         current_version = self.config.version
         latest_version = self.get_latest_version(github_repo)
@@ -99,350 +313,606 @@ class SensorUpdater:
 
         return (current_version, latest_version)
 
-    def _check_for_new_config(self, mac_address: str) -> bool:
-        if self.config.auto_update_enabled is False:
-            return
-
-        if self.config.auto_update_config_enabled is False:
-            return
-
-        import utime
+    # The tag list is revalidated with its ETag, an unchanged repository costs a 304 without a body
+    def get_latest_version(self, github_repo='alexbarnsley/esp32-solar-sensor'):
+        import sys
+        import urequests as requests
+        from lib.config import Config
+        from lib.gc_policy import gc_policy
+        from lib.recovery import recovery, SUBSYSTEM_HTTP
+        from lib.utils import get_header
 
-        if utime.time() - self.config.last_update_config_check < 3600:
-            return
+        self.logger.output('Getting latest version from GitHub...')
 
-        self.config.update_cache('last_updated_config_check', utime.time())
+        url = f'https://api.github.com/repos/{github_repo}/tags?per_page=100'
 
-        config_check_url = self.config.auto_update_config_check_url
-        if config_check_url is None:
-            self.logger.output('No config URL provided, skipping config update.')
+        # Stored as [url, etag, latest version]
+        cached = Config.get_cache('latest_tag')
+        if cached is not None and cached[0] != url:
+            cached = None
 
-            return
+        headers = self.github_request_headers
+        if cached is not None:
+            headers['If-None-Match'] = cached[1]
 
-        has_update = False
+        version = None
         try:
-            self.logger.output('Current config last modified at:', self.config.last_updated)
-
-            import urequests as requests
-
-            response = requests.get(
-                config_check_url,
+            response = recovery.call(
+                SUBSYSTEM_HTTP,
+                requests.get,
+                url,
+                headers=headers,
                 timeout=10,
                 stream=True,
-                headers=self.sensor_request_headers,
-                json={
-                    "address": mac_address,
-                }
             )
 
-            self.logger.output('Checking if config file needs updating from', config_check_url, 'with headers', self.sensor_request_headers)
-
-            response_json = response.json()
-            self.logger.output('Config file response:', response_json)
-
-            if 'error' in response_json:
-                self.logger.output('Error fetching config file:', response_json['error'])
+            try:
+                if response.status_code == 304:
+                    self.logger.output('Tags unchanged.')
 
-            elif response.status_code != 200:
-                self.logger.output('Failed to fetch config file, status code:', response.status_code)
+                    version = cached[2]
 
-            elif 'config_updated_at' not in response_json:
-                self.logger.output('No config found in response, skipping config update.')
+                elif response.status_code != 200:
+                    self.logger.output('Failed to fetch tags, status code:', response.status_code)
 
-            elif 'config_updated_at' in response_json and response_json['config_updated_at'] <= self.config.last_updated:
-                self.logger.output(f'Config file is up to date, no update needed | config_updated_at: {response_json["config_updated_at"]} | last_updated: {self.config.last_updated}')
+                else:
+                    # Only the tag names are read, GitHub does not order the tags by version
+                    for name in scan_json_strings(response.raw, b'name'):
+                        if version is None or parse_version(name) > parse_version(version):
+                            version = name
 
-            else:
-                has_update = True
+                    etag = get_header(response.headers, 'ETag')
+                    if version is not None and etag is not None:
+                        self.config.update_cache('latest_tag', [url, etag, version])
 
-            response.close()
+            finally:
+                response.close()
 
             del response
-            del response_json
 
         except OSError as e:
-            if str(e.args[0]) != '-116':
-                self.logger.output('OSError checking if config file needs updating:', e)
-                if self.config.debug:
-                    import sys
-
-                    sys.print_exception(e)
-
-                import machine
-
-                machine.reset()
+            # Already counted against the HTTP subsystem by recovery.call
+            self.logger.output('OSError getting latest version:', e)
+            if self.config.debug:
+                sys.print_exception(e)
 
         except Exception as e:
-            self.logger.output('Failed checking if config file needs updating:', e)
+            self.logger.output('Failed getting latest version:', e)
             if self.config.debug:
-                import sys
-
                 sys.print_exception(e)
 
-        import gc
+        gc_policy.between_phases()
+
+        return version
+
+    # Fallback when the archive cannot be used: one request per directory listing and one per changed file
+    def _download_files_slice(self, task) -> bool:
+        from lib.utils import copy_file
 
-        gc.collect()
+        if self.pending_dirs is None:
+            # Files staged before a reset are kept, they are only downloaded again if their hash does not match
+            self._mkdir(self._modulepath(self.staging_dir))
 
-        return has_update
+            self._load_manifest()
 
-    def _download_config_file(self, mac_address: str) -> bool:
-        if not self._check_for_new_config(mac_address):
-            return False
+            self.pending_dirs = ['']
+            self.pending_files = []
 
-        config_url = self.config.auto_update_config_url
-        if config_url is None:
-            self.logger.output('No config URL provided, skipping config update.')
+        while not task.budget_exceeded():
+            if self.pending_files:
+                git_path, local_path, sha, size = self.pending_files.pop(0)
 
-            return
+                self.new_manifest[local_path] = sha
 
-        self.logger.output('Downloading latest config file from', config_url)
+                staged_path = f'{self.staging_dir}/{local_path}'
 
-        has_updated = False
-        try:
-            self.logger.output('Current config last modified at:', self.config.last_updated)
+                if self._git_blob_sha(staged_path) == sha:
+                    self.bytes_downloaded += size
 
-            import urequests as requests
+                elif self._is_installed(local_path, sha):
+                    self.logger.output(f'\tUnchanged: {local_path}')
 
-            response = requests.get(
-                config_url,
-                timeout=10,
-                stream=True,
-                headers=self.sensor_request_headers,
-                json={
-                    "address": mac_address,
-                }
-            )
+                    # The slot needs the complete release, a local copy is much cheaper than downloading it again
+                    copy_file(self.slot_state.path(local_path), staged_path)
+
+                    self.bytes_saved += size
 
-            response_json = response.json()
-            self.logger.output('Config file response:', response_json)
+                else:
+                    self.logger.output(f'\tDownloading: {git_path} to {local_path}')
 
-            if 'error' in response_json:
-                self.logger.output('Error fetching config file:', response_json['error'])
+                    self._download_file(self.job['version'], git_path, self.github_repo, local_path, sha, size)
 
-            elif response.status_code != 200:
-                self.logger.output('Failed to fetch config file, status code:', response.status_code)
+                    self.bytes_downloaded += size
 
-            elif 'config' not in response_json:
-                self.logger.output('No config found in response, skipping config update.')
+            elif self.pending_dirs:
+                self._list_directory(self.pending_dirs.pop(0))
 
             else:
-                from lib.utils import copy_file, json_dumps_with_indent
+                self.pending_dirs = None
 
-                with open('config.updated.json', 'wb') as configfile:
+                self._save_manifest()
 
-                    configfile.write(json_dumps_with_indent(response_json['config']).encode('utf-8'))
-                    configfile.close()
+                return True
 
-                del configfile
+        return False
 
-                import os, utime
+    def _list_directory(self, sub_dir: str):
+        from lib.gc_policy import gc_policy
 
-                copy_file('config.updated.json', 'config.json')
-                os.remove('config.updated.json')
+        github_src_dir = self.github_src_dir
 
-                self.config.update_cache('config_last_updated_at', response_json.get('config_updated_at', utime.time()))
+        for git_path, name, file_type, sha, size in self._get_listing(sub_dir):
+            # Files are installed relative to the source directory, e.g. a prebuilt .mpy tree in "dist"
+            local_path = git_path[len(github_src_dir) - 1:] if git_path.startswith(github_src_dir[1:]) else git_path
 
-                self.logger.output('Config file updated successfully.')
+            if self._is_skipped(local_path, file_type == 'dir'):
+                self.logger.output('Skipping', git_path)
 
-                has_updated = True
+                continue
 
-            response.close()
+            if file_type == 'file':
+                self.pending_files.append((git_path, local_path, sha, size))
 
-            del response
-            del response_json
+            elif file_type == 'dir':
+                self.logger.output('Creating dir', local_path)
 
-        except OSError as e:
-            if str(e.args[0]) != '-116':
-                self.logger.output('OSError updating config file:', e)
-                if self.config.debug:
-                    import sys
+                self._mkdir(f'{self.staging_dir}/{local_path}')
 
-                    sys.print_exception(e)
+                self.pending_dirs.append(sub_dir + '/' + name)
 
-                import machine
+        gc_policy.between_phases()
 
-                machine.reset()
+    # Listings are cached on flash with their ETag rather than in the cache store, which is held in memory
+    def _get_listing(self, sub_dir: str) -> list:
+        import hashlib, sys, ubinascii
+        import ujson as json
+        import urequests as requests
+        from lib.recovery import recovery, SUBSYSTEM_HTTP
+        from lib.utils import get_header
 
-        except Exception as e:
-            self.logger.output('Failed to update config file:', e)
-            if self.config.debug:
-                import sys
+        url = f'https://api.github.com/repos/{self.github_repo}/contents{self.github_src_dir}{sub_dir}?ref=refs/tags/{self.job["version"]}'
+        cache_path = f'{LISTING_CACHE_DIR}/{ubinascii.hexlify(hashlib.sha1(url.encode()).digest()).decode()[:16]}.json'
 
-                sys.print_exception(e)
+        headers = self.github_request_headers
 
-        import gc
+        cached = None
+        try:
+            with open(cache_path, 'r') as f:
+                cached = json.load(f)
 
-        gc.collect()
+            headers['If-None-Match'] = cached['etag']
 
-        return has_updated
+        except (OSError, ValueError, KeyError):
+            cached = None
 
-    def get_latest_version(self, github_repo='alexbarnsley/esp32-solar-sensor'):
-        import gc, machine, sys
-        import urequests as requests
+        recovery.feed()
 
-        self.logger.output('Getting latest version from GitHub...')
+        self.logger.output('Getting file list from GitHub...', url)
 
         try:
-            latest_release = requests.get(
-                f'https://api.github.com/repos/{github_repo}/tags',
-                headers=self.github_request_headers,
+            response = recovery.call(
+                SUBSYSTEM_HTTP,
+                requests.get,
+                url,
+                headers=headers,
                 timeout=10,
                 stream=True,
             )
 
-            gh_json = latest_release.json()
-
-            version = None
             try:
-                version = gh_json[0]['name']
+                if response.status_code == 304:
+                    return cached['files']
 
-            except OSError as e:
-                if str(e.args[0]) != '-116':
-                    self.logger.output(f'OSError getting latest version: {e}')
+                if response.status_code != 200:
+                    raise OSError(f'File list request failed with status {response.status_code}')
 
-                    machine.reset()
+                files = [
+                    [file['path'], file['name'], file['type'], file['sha'], file['size']]
+                    for file in response.json()
+                ]
 
-            except KeyError as e:
-                self.logger.output(
-                    "Release not found: \n",
-                    "Please ensure release as marked as 'latest', rather than pre-release \n",
-                    f"github api message: \n {gh_json} \n "
-                )
+                etag = get_header(response.headers, 'ETag')
 
-                if self.config.debug:
-                    sys.print_exception(e)
-
-            latest_release.close()
-
-            del latest_release
-            del gh_json
+            finally:
+                response.close()
 
         except OSError as e:
-            if str(e.args[0]) != '-116':
-                self.logger.output('OSError getting latest version:', e)
-                if self.config.debug:
-                    sys.print_exception(e)
-
-                machine.reset()
-
-        except Exception as e:
-            self.logger.output('Failed getting latest version:', e)
+            self.logger.output('OSError listing files:', e)
             if self.config.debug:
                 sys.print_exception(e)
 
-        gc.collect()
+            raise
 
-        return version
+        if etag is not None:
+            self._mkdir(LISTING_CACHE_DIR)
+
+            with open(cache_path, 'w') as f:
+                json.dump({'etag': etag, 'files': files}, f)
+
+        return files
 
-    def _download_all_files(self, version, github_src_dir, sub_dir='', github_repo='alexbarnsley/esp32-solar-sensor'):
-        import gc, machine, sys, utime
+    # Each slice downloads one range of the archive, so a reset only loses the range in flight
+    def _download_archive_slice(self) -> bool:
         import urequests as requests
+        from lib.recovery import recovery, SUBSYSTEM_HTTP
+        from lib.utils import get_header, write_stream
+
+        recovery.feed()
+
+        slice_bytes = self.config.update_slice_bytes
+        etag, total = self.job.get('archive') or (None, None)
+
+        if self.archive_response is not None:
+            # A server which ignored the range keeps sending the whole archive, carried on from where the last slice stopped
+            return self._stream_archive_slice('ab', slice_bytes, total)
+
+        offset = self._archive_size()
 
-        gc.collect()
+        headers = self.github_request_headers
+        headers['Range'] = f'bytes={offset}-{offset + slice_bytes - 1}'
+
+        # The rest of the range is only sent if the archive is still the one the first part came from
+        if offset > 0 and etag is not None:
+            headers['If-Range'] = etag
+
+        response = recovery.call(
+            SUBSYSTEM_HTTP,
+            requests.get,
+            f'https://api.github.com/repos/{self.github_repo}/tarball/refs/tags/{self.job["version"]}',
+            headers=headers,
+            timeout=10,
+            stream=True,
+        )
 
         try:
-            file_list = requests.get(
-                f'https://api.github.com/repos/{github_repo}/contents{github_src_dir}{sub_dir}?ref=refs/tags/{version}',
-                headers=self.github_request_headers,
-                timeout=10,
-                stream=True,
-            )
+            if response.status_code == 416:
+                # Nothing left after the offset, the previous slice ended exactly at the end of the archive
+                return self._downloaded(True, total)
 
-            file_list_json = file_list.json()
+            if response.status_code == 200:
+                # The server ignored the range or the archive changed, either way the whole archive follows.
+                # The response is kept open and read one slice at a time, so nothing is downloaded twice.
+                self.logger.output('Server sent the whole archive, downloading it over a single response...')
 
-            self.logger.output('Getting file list from GitHub...', f'https://api.github.com/repos/{github_repo}/contents{github_src_dir}{sub_dir}?ref=refs/tags/{version}',)
-            self.logger.output('File list JSON:', file_list_json)
+                content_length = get_header(response.headers, 'Content-Length')
+                self._save_archive(get_header(response.headers, 'ETag'), int(content_length) if content_length is not None and content_length.strip().isdigit() else None)
 
-            for file in file_list_json:
-                if file['path'].startswith('.') or (file['path'].startswith('thirdparty') and file['type'] == 'dir'):
-                    self.logger.output('Skipping', file['path'])
+                self.archive_response = response
+                response = None
 
-                    gc.collect()
+                return self._stream_archive_slice('wb', slice_bytes, self.job['archive'][1])
 
-                    continue
+            if response.status_code != 206:
+                raise OSError(f'Release archive request failed with status {response.status_code}')
 
-                self.logger.output('Processing', file)
-                self.logger.output(file['path'])
+            if offset == 0:
+                self._save_archive(get_header(response.headers, 'ETag'), get_content_range_total(response.headers))
+                etag, total = self.job['archive']
 
-                git_path = file['path']
+            with open(ARCHIVE_FILE, 'ab') as out:
+                written = write_stream(response.raw, out)
 
-                if file['type'] == 'file':
-                    self.logger.output(f'\tDownloading: {git_path} to {git_path}')
+            return self._downloaded(written < slice_bytes, total)
 
-                    self._download_file(version, git_path, github_repo)
-                elif file['type'] == 'dir':
-                    self.logger.output('Creating dir', git_path)
+        finally:
+            if response is not None:
+                response.close()
 
-                    self._mkdir(f'{self.config.update_new_version_dir}/{git_path}')
-                    self._download_all_files(version, github_src_dir, sub_dir + '/' + file['name'], github_repo)
+    def _stream_archive_slice(self, mode: str, slice_bytes: int, total: int | None) -> bool:
+        from lib.utils import write_stream
 
-                utime.sleep(0.1)
+        with open(ARCHIVE_FILE, mode) as out:
+            written = write_stream(self.archive_response.raw, out, limit=slice_bytes)
 
-                gc.collect()
+        has_ended = written < slice_bytes
 
-            file_list.close()
+        # A connection dropped between slices ends the body early, the next request starts the archive over
+        if has_ended and total is not None and self._archive_size() < total:
+            raise OSError(f'Release archive download ended at {self._archive_size()} of {total} bytes')
 
-            del file_list
-            del file_list_json
+        return self._downloaded(has_ended, total)
 
-        except OSError as e:
-            self.logger.output('OSError downloading files:', e)
-            if self.config.debug:
-                sys.print_exception(e)
+    def _save_archive(self, etag: str | None, total: int | None):
+        self.job['archive'] = [etag, total]
 
-            machine.reset()
+        self._save_job(JOB_DOWNLOAD)
 
-        except Exception as e:
-            self.logger.output('Failed to downloading files:', e)
-            if self.config.debug:
-                sys.print_exception(e)
+    # Returns True once the whole archive is on flash, checked against the size the server announced
+    def _downloaded(self, is_complete: bool, total: int | None) -> bool:
+        size = self._archive_size()
+
+        self.logger.output(f'Downloaded {size} bytes of release archive')
+
+        if total is not None:
+            is_complete = size >= total
+
+            if size > total:
+                raise ValueError(f'Release archive is {size} bytes, expected {total}')
+
+        if is_complete:
+            self._close_response()
+
+        return is_complete
+
+    # Extracts entries from the downloaded archive until the slice budget is spent
+    def _extract_archive_slice(self, task) -> bool:
+        from lib.tar_stream import TarStream
+
+        if self.archive is None:
+            # Extraction restarts from the beginning after a reset, it only reads from flash
+            self._clear_staging()
+            self._mkdir(self._modulepath(self.staging_dir))
+
+            self._load_manifest()
+
+            self.archive_file = open(ARCHIVE_FILE, 'rb')
+            self.archive = TarStream(self._gunzip(self.archive_file))
+
+        while not task.budget_exceeded():
+            entry = self.archive.next()
+            if entry is None:
+                self._close_archive()
+                self._remove_file(ARCHIVE_FILE)
+
+                self._save_manifest()
+
+                return True
+
+            self._extract_entry(self.archive, entry)
+
+        return False
+
+    def _extract_entry(self, archive, entry):
+        import ubinascii
+        from lib.gc_policy import gc_policy
+        from lib.recovery import recovery
+        from lib.tar_stream import TYPE_DIR, TYPE_FILE
+        from lib.utils import write_stream
+
+        name, size, entry_type = entry
+        github_src_dir = self.github_src_dir
+
+        # GitHub puts the release inside a single "<owner>-<repo>-<commit>" directory
+        git_path = name[name.find('/') + 1:].rstrip('/')
+        if not git_path or not git_path.startswith(github_src_dir[1:]) or entry_type not in (TYPE_DIR, TYPE_FILE):
+            return
+
+        local_path = git_path[len(github_src_dir) - 1:]
+        if not local_path:
+            return
+
+        if self._is_skipped(local_path, entry_type == TYPE_DIR):
+            self.logger.output('Skipping', git_path)
+
+            return
+
+        target_path = f'{self.staging_dir}/{local_path}'
+
+        if entry_type == TYPE_DIR:
+            self._mkdir(target_path)
+
+            return
+
+        recovery.feed()
+
+        digest = self._blob_digest(size)
+
+        with open(target_path, 'wb') as out:
+            written = write_stream(archive, out, digest)
+
+        if written != size:
+            raise ValueError(f'{local_path} has {written} bytes, expected {size}')
+
+        sha = ubinascii.hexlify(digest.digest()).decode()
+
+        self.new_manifest[local_path] = sha
+
+        if self._is_installed(local_path, sha):
+            self.bytes_saved += size
+        else:
+            self.logger.output(f'\tExtracted: {local_path}')
+
+            self.bytes_downloaded += size
+
+        gc_policy.between_phases()
+
+    def _close_archive(self):
+        self._close_response()
+
+        self.archive = None
+
+        if self.archive_file is not None:
+            self.archive_file.close()
 
-        gc.collect()
+            self.archive_file = None
 
-    def _download_file(self, version, git_path, github_repo='alexbarnsley/esp32-solar-sensor'):
-        import machine, sys
+    def _archive_size(self) -> int:
+        import os
+
+        try:
+            return os.stat(ARCHIVE_FILE)[6]
+
+        except OSError:
+            return 0
+
+    def _close_response(self):
+        if self.archive_response is not None:
+            self.archive_response.close()
+
+            self.archive_response = None
+
+    def _remove_file(self, path: str):
+        import os
+
+        try:
+            os.remove(path)
+
+        except OSError:
+            pass
+
+    def _gunzip(self, stream):
+        try:
+            import deflate
+
+            return deflate.DeflateIO(stream, deflate.GZIP)
+
+        except ImportError:
+            import uzlib
+
+            return uzlib.DecompIO(stream, 31)
+
+    def _is_skipped(self, local_path: str, is_dir: bool) -> bool:
+        parts = local_path.split('/')
+
+        for part in parts:
+            if part.startswith('.'):
+                return True
+
+        return parts[0].startswith('thirdparty') and (is_dir or len(parts) > 1)
+
+    def _download_file(self, version, git_path, github_repo='alexbarnsley/esp32-solar-sensor', local_path=None, sha=None, size=None):
+        import sys
         import urequests as requests
+        from lib.recovery import recovery, SUBSYSTEM_HTTP
+
+        recovery.feed()
 
         try:
-            response = requests.get(
+            response = recovery.call(
+                SUBSYSTEM_HTTP,
+                requests.get,
                 f'https://raw.githubusercontent.com/{github_repo}/{version}/{git_path}',
                 headers=self.github_request_headers,
                 timeout=10,
                 stream=True,
             )
 
-            with open(f'{self.config.update_new_version_dir}/{git_path}', "wb") as out:
-                out.write(response.content)
-                out.close()
+            if local_path is None:
+                local_path = git_path
+
+            try:
+                self._save_file(response.raw, f'{self.staging_dir}/{local_path}', sha, size)
+
+            finally:
+                response.close()
 
         except OSError as e:
             self.logger.output(f'OSError download file "{git_path}":', e)
             if self.config.debug:
                 sys.print_exception(e)
 
-            machine.reset()
+            raise
 
         except Exception as e:
             self.logger.output(f'Failed download file "{git_path}":', e)
             if self.config.debug:
                 sys.print_exception(e)
 
-    def _download_new_version(self, version, github_src_dir, github_repo='alexbarnsley/esp32-solar-sensor'):
-        self.logger.output(f'Downloading version {version}...')
+            raise
+
+    # Streamed to flash through the shared copy buffer, so memory use does not depend on the file size
+    def _save_file(self, stream, path: str, sha: str | None = None, size: int | None = None):
+        import ubinascii
+        from lib.utils import write_stream
+
+        digest = self._blob_digest(size) if sha is not None and size is not None else None
 
-        self._download_all_files(version, github_src_dir, '', github_repo)
+        with open(path, 'wb') as out:
+            written = write_stream(stream, out, digest)
 
-        self.logger.output(f'Version {version} downloaded to {self._modulepath(self.config.update_new_version_dir)}')
+        if size is not None and written != size:
+            raise ValueError(f'{path} has {written} bytes, expected {size}')
+
+        if digest is not None and ubinascii.hexlify(digest.digest()).decode() != sha:
+            raise ValueError(f'{path} does not match hash {sha}')
 
     def _install_new_version(self, latest_version):
-        self.logger.output('Installing new version at...')
+        self.logger.output(f'Activating new version in {self._modulepath(self.staging_dir)}...')
+
+        self._finish_job()
 
-        self._copy_directory(self._modulepath(self.config.update_new_version_dir), '/')
-        self._rmtree(self._modulepath(self.config.update_new_version_dir))
+        # Only the pointer is written, so the install takes the same time whatever the size of the release
+        self.slot_state.switch(self.staging_dir, latest_version, self.config.version, self.config.update_health_boots)
 
         self.logger.output('Update installed')
+        self.logger.info('Update to %s downloaded %d bytes, %d bytes unchanged', latest_version, self.bytes_downloaded, self.bytes_saved)
 
         self.config.update_cache('version', latest_version)
+        self.config.update_cache('last_update_stats', [self.bytes_downloaded, self.bytes_saved])
+
+    def _load_manifest(self):
+        import ujson as json
+
+        self.new_manifest = {}
+        self.bytes_downloaded = 0
+        self.bytes_saved = 0
+
+        try:
+            with open(self.slot_state.path(MANIFEST_FILE), 'r') as f:
+                self.manifest = json.load(f)
+
+        except (OSError, ValueError):
+            # Hashes of files installed before the manifest existed are computed from flash instead
+            self.manifest = {}
+
+    def _save_manifest(self):
+        import ujson as json
+
+        with open(f'{self.staging_dir}/{MANIFEST_FILE}', 'w') as f:
+            json.dump(self.new_manifest, f)
+
+        self.manifest = self.new_manifest
+
+    def _is_installed(self, local_path: str, sha: str) -> bool:
+        import os
+
+        installed_sha = self.manifest.get(local_path)
+        if installed_sha is None:
+            return self._git_blob_sha(self.slot_state.path(local_path)) == sha
+
+        try:
+            os.stat(self.slot_state.path(local_path))
+
+        except OSError:
+            return False
+
+        return installed_sha == sha
+
+    # Same hash as the "sha" the GitHub contents API returns for a file
+    def _git_blob_sha(self, path: str) -> str | None:
+        import os, ubinascii
+        from lib.utils import get_copy_buffer
+
+        try:
+            size = os.stat(path)[6]
+
+        except OSError:
+            return None
+
+        digest = self._blob_digest(size)
+        buffer = get_copy_buffer()
+
+        with open(path, 'rb') as f:
+            while True:
+                read_size = f.readinto(buffer)
+                if not read_size:
+                    break
+
+                digest.update(memoryview(buffer)[:read_size])
+
+        return ubinascii.hexlify(digest.digest()).decode()
+
+    def _blob_digest(self, size: int):
+        import hashlib
+
+        return hashlib.sha1(f'blob {size}\0'.encode())
+
+    def _clear_staging(self):
+        # Never the rollback target of a release on trial, run_slice does not get this far then either
+        if self.slot_state.is_on_trial:
+            raise OSError(f'{self.staging_dir} holds the rollback release')
+
+        self._rmtree(self._modulepath(self.staging_dir))
 
     def _rmtree(self, directory):
         import os
@@ -459,22 +929,8 @@ class SensorUpdater:
 
         os.rmdir(directory)
 
-    def _copy_directory(self, from_path, to_path):
-        import os
-        from lib.utils import copy_file
-
-        if not self._exists_dir(to_path):
-            self._mk_dirs(to_path)
-
-        for entry in os.ilistdir(from_path):
-            is_dir = entry[1] == 0x4000
-            if is_dir:
-                self._copy_directory(from_path + '/' + entry[0], to_path + '/' + entry[0])
-            else:
-                copy_file(from_path + '/' + entry[0], to_path + '/' + entry[0])
-
     def _exists_dir(self, path) -> bool:
-        import os, machine
+        import os
 
         try:
             os.listdir(path)
@@ -485,18 +941,14 @@ class SensorUpdater:
             if e.args[0] != 2:
                 print(f'OSError checking directory exists: {e}')
 
-                machine.reset()
+                from lib.recovery import recovery, SUBSYSTEM_STORAGE
 
-        except:
-            return False
+                recovery.reset(SUBSYSTEM_STORAGE, e)
 
-    def _mk_dirs(self, path: str):
-        paths = path.split('/')
+            return False
 
-        path_to_create = ''
-        for x in paths:
-            self._mkdir(path_to_create + x)
-            path_to_create = path_to_create + x + '/'
+        except:
+            return False
 
     # different micropython versions act differently when directory already exists
     def _mkdir(self, path: str):
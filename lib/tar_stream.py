@@ -0,0 +1,139 @@
+BLOCK_SIZE = 512
+
+TYPE_FILE = 0
+TYPE_DIR = 1
+TYPE_OTHER = 2
+
+# Reads the entries of a tar archive one at a time from a stream. Only one 512 byte header
+# is held in memory, the contents of the current entry are read with readinto.
+class TarStream:
+    stream = None
+    header: bytearray
+    remaining: int = 0
+    padding: int = 0
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.header = bytearray(BLOCK_SIZE)
+        self.remaining = 0
+        self.padding = 0
+
+    # Returns (name, size, type) of the next entry, or None at the end of the archive
+    def next(self) -> tuple[str, int, int] | None:
+        long_name = None
+
+        while True:
+            self.skip()
+
+            if not self.read_exactly(self.header) or not any(self.header):
+                return None
+
+            name = self.field(0, 100).decode()
+            size = int(self.field(124, 136).strip().decode() or '0', 8)
+            type_flag = self.header[156]
+
+            if self.header[257:262] == b'ustar':
+                prefix = self.field(345, 500).decode()
+                if prefix:
+                    name = prefix + '/' + name
+
+            self.remaining = size
+            self.padding = -size % BLOCK_SIZE
+
+            # Names too long for the header come in an entry of their own before the file
+            if type_flag == ord('x') or type_flag == ord('L'):
+                data = self.read(size)
+
+                long_name = self.pax_path(data) if type_flag == ord('x') else data.rstrip(b'\0').decode()
+
+                continue
+
+            if long_name is not None:
+                name = long_name
+
+            if type_flag in (0, ord('0'), ord('7')):
+                return name, size, TYPE_FILE
+
+            if type_flag == ord('5'):
+                return name, size, TYPE_DIR
+
+            return name, size, TYPE_OTHER
+
+    def readinto(self, buffer) -> int:
+        if self.remaining <= 0:
+            return 0
+
+        view = memoryview(buffer)
+        if len(view) > self.remaining:
+            view = view[:self.remaining]
+
+        size = self.stream.readinto(view)
+        if not size:
+            raise OSError('Archive ended within an entry')
+
+        self.remaining -= size
+
+        return size
+
+    def read(self, size: int) -> bytes:
+        data = bytearray(size)
+
+        if not self.read_exactly(data):
+            raise OSError('Archive ended within an entry')
+
+        self.remaining -= size
+
+        return bytes(data)
+
+    def skip(self):
+        to_skip = self.remaining + self.padding
+
+        self.remaining = 0
+        self.padding = 0
+
+        view = memoryview(self.header)
+        while to_skip > 0:
+            size = self.stream.readinto(view[:min(to_skip, BLOCK_SIZE)])
+            if not size:
+                return
+
+            to_skip -= size
+
+    def read_exactly(self, buffer) -> bool:
+        view = memoryview(buffer)
+
+        position = 0
+        while position < len(view):
+            size = self.stream.readinto(view[position:])
+            if not size:
+                return False
+
+            position += size
+
+        return True
+
+    def field(self, start: int, end: int) -> bytes:
+        value = bytes(self.header[start:end])
+
+        end = value.find(b'\0')
+
+        return value if end < 0 else value[:end]
+
+    @staticmethod
+    def pax_path(data: bytes) -> str | None:
+        # Records are in the format "<length> <key>=<value>\n"
+        position = 0
+        while position < len(data):
+            separator = data.find(b' ', position)
+            if separator < 0:
+                break
+
+            length = int(data[position:separator])
+            record = data[separator + 1:position + length - 1]
+
+            if record.startswith(b'path='):
+                return record[5:].decode()
+
+            position += length
+
+        return None
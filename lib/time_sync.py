@@ -0,0 +1,103 @@
+import ntptime
+import utime
+
+from lib.clock import clock
+from lib.logger import logger
+from lib.rtc_state import rtc_state
+
+# An RTC reading before this has never been set, utime.mktime keeps it independent of the port's epoch
+MIN_VALID_TIME = utime.mktime((2024, 1, 1, 0, 0, 0, 0, 0))
+
+# The interval is shortened when the measured drift would let the clock stray further than this between syncs
+MAX_ERROR_S = 2
+MIN_INTERVAL_S = 3600
+
+# Keeps the RTC set from NTP in the background. The time of the last sync and the measured drift are kept
+# in RTC memory, so after a soft, watchdog or deep-sleep reset the RTC is trusted and no sync is needed.
+class TimeSync:
+    servers: list[str] = []
+    timeout: int = 2
+    sync_interval: int = 86400
+    is_synced: bool = False
+
+    def __init__(self):
+        self.servers = []
+        self.is_synced = False
+
+    def configure(self, config):
+        self.reconfigure(config)
+
+        now = clock.time()
+        synced_at = rtc_state.get('time_synced_at')
+
+        self.is_synced = synced_at is not None and now >= MIN_VALID_TIME and 0 <= now - synced_at < self.sync_interval
+
+        if self.is_synced:
+            logger.output(f'RTC synced {now - synced_at}s ago, skipping time sync')
+
+    def reconfigure(self, config):
+        self.servers = config.time_servers
+        self.timeout = config.time_timeout
+        self.sync_interval = config.time_sync_interval
+
+    def interval(self) -> int:
+        drift_ppm = rtc_state.get('time_drift_ppm', 0)
+        if drift_ppm == 0:
+            return self.sync_interval
+
+        return max(MIN_INTERVAL_S, min(self.sync_interval, MAX_ERROR_S * 1000000 // abs(drift_ppm)))
+
+    def seconds_until_due(self) -> int:
+        if not self.is_synced:
+            return 0
+
+        return max(0, rtc_state.get('time_synced_at') + self.interval() - clock.time())
+
+    def sync(self) -> bool:
+        for server in self.servers:
+            ntptime.host = server
+            ntptime.timeout = self.timeout
+
+            try:
+                ntp_time = ntptime.time()
+
+            except (OSError, OverflowError) as e:
+                logger.output(f'Time sync with {server} failed: {e}')
+
+                continue
+
+            self.set_time(ntp_time)
+
+            logger.output(f'Time synced with {server}:', clock.localtime())
+
+            return True
+
+        return False
+
+    def set_time(self, ntp_time: int):
+        now = clock.time()
+        synced_at = rtc_state.get('time_synced_at')
+
+        # Drift can only be measured against a clock which was set by the previous sync
+        if self.is_synced and synced_at is not None and now - synced_at >= MIN_INTERVAL_S:
+            drift_ppm = (ntp_time - now) * 1000000 // (now - synced_at)
+
+            logger.output(f'RTC was {ntp_time - now}s off after {now - synced_at}s ({drift_ppm}ppm)')
+
+            rtc_state.set('time_drift_ppm', drift_ppm)
+
+        clock.set_time(ntp_time)
+
+        self.is_synced = True
+
+        rtc_state.set('time_synced_at', ntp_time)
+        rtc_state.save()
+
+    # Readings are stamped with ticks when taken, which stay valid when the clock is set afterwards
+    def timestamp(self, ticks_ms: int) -> int | None:
+        if not self.is_synced:
+            return None
+
+        return clock.time() - clock.ticks_diff(clock.ticks_ms(), ticks_ms) // 1000
+
+time_sync = TimeSync()
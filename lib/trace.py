@@ -0,0 +1,117 @@
+import utime
+from array import array
+
+from lib.phases import PHASE_NAMES
+
+NO_DEVICE = 0xff
+
+class Trace:
+    enabled: bool = False
+    capacity: int = 0
+    phases: bytearray
+    devices: bytearray
+    durations: array
+    index: int = 0
+    count: int = 0
+    device_addresses: list[str] = []
+
+    def __init__(self, capacity: int = 256):
+        self.enabled = False
+        self.capacity = capacity
+        self.index = 0
+        self.count = 0
+        self.device_addresses = []
+
+        # Preallocated ring of spans, recording one never allocates
+        self.phases = bytearray(capacity)
+        self.devices = bytearray(capacity)
+        self.durations = array('L', [0] * capacity)
+
+    def enable(self, enabled: bool = True):
+        self.enabled = enabled
+
+    def device(self, address: str) -> int:
+        # Nothing is recorded with tracing off, so the address is not kept either
+        if not self.enabled:
+            return NO_DEVICE
+
+        if address in self.device_addresses:
+            return self.device_addresses.index(address)
+
+        if len(self.device_addresses) >= NO_DEVICE:
+            return NO_DEVICE
+
+        self.device_addresses.append(address)
+
+        return len(self.device_addresses) - 1
+
+    def begin(self) -> int:
+        return utime.ticks_us()
+
+    def end(self, phase: int, started_at: int, device: int = NO_DEVICE):
+        if not self.enabled:
+            return
+
+        index = self.index
+
+        self.phases[index] = phase
+        self.devices[index] = device
+        self.durations[index] = utime.ticks_diff(utime.ticks_us(), started_at)
+
+        self.index = (index + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def durations_for(self, phase: int, device: int | None = None) -> list[int]:
+        durations = [
+            self.durations[i]
+            for i in range(self.count)
+            if self.phases[i] == phase and (device is None or self.devices[i] == device)
+        ]
+
+        durations.sort()
+
+        return durations
+
+    @staticmethod
+    def percentiles(durations: list[int]) -> list[int]:
+        # [count, p50, p95, max]
+        last = len(durations) - 1
+
+        return [len(durations), durations[last * 50 // 100], durations[last * 95 // 100], durations[last]]
+
+    def summary(self) -> dict:
+        phases = {}
+        for phase, name in enumerate(PHASE_NAMES):
+            durations = self.durations_for(phase)
+            if durations:
+                phases[name] = self.percentiles(durations)
+
+        devices = {}
+        for device, address in enumerate(self.device_addresses):
+            device_phases = {}
+            for phase, name in enumerate(PHASE_NAMES):
+                durations = self.durations_for(phase, device)
+                if durations:
+                    device_phases[name] = self.percentiles(durations)
+
+            if device_phases:
+                devices[address] = device_phases
+
+        return {
+            'phases': phases,
+            'devices': devices,
+        }
+
+    def dump(self):
+        summary = self.summary()
+
+        print('phase', 'device', 'count', 'p50_us', 'p95_us', 'max_us', sep='\t')
+
+        for name, values in summary['phases'].items():
+            print(name, '-', *values, sep='\t')
+
+        for address, device_phases in summary['devices'].items():
+            for name, values in device_phases.items():
+                print(name, address, *values, sep='\t')
+
+trace = Trace()
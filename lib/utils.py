@@ -1,70 +1,162 @@
-import gc
+import os
 import ujson as json
-import utime
+
+from lib.clock import clock
+from lib.gc_policy import gc_policy
 
 def wait_for(condition_func, *, timeout=10, check_interval=0.1, on_timeout=None) -> bool:
-    start_time = utime.ticks_ms()
+    start_time = clock.ticks_ms()
     while not condition_func():
-        if utime.ticks_diff(utime.ticks_ms(), start_time) > timeout * 1000:
+        if clock.ticks_diff(clock.ticks_ms(), start_time) > timeout * 1000:
             if on_timeout:
                 on_timeout()
 
             return False
 
-        utime.sleep(check_interval)
+        clock.sleep(check_interval)
 
     return True
 
+# LittleFS block size on the ESP32 port, shared by every copy to avoid allocating a buffer per file
+COPY_BUFFER_SIZE = 4096
+
+copy_buffer: bytearray | None = None
+
+def get_copy_buffer() -> bytearray:
+    global copy_buffer
+
+    if copy_buffer is None:
+        copy_buffer = bytearray(COPY_BUFFER_SIZE)
+
+    return copy_buffer
+
+def write_stream(from_stream, to_file, digest=None, limit: int | None = None) -> int:
+    buffer = get_copy_buffer()
+    view = memoryview(buffer)
+
+    written = 0
+    while limit is None or written < limit:
+        if limit is None or limit - written >= COPY_BUFFER_SIZE:
+            size = from_stream.readinto(buffer)
+        else:
+            size = from_stream.readinto(view[:limit - written])
+
+        if not size:
+            break
+
+        chunk = buffer if size == COPY_BUFFER_SIZE else view[:size]
+
+        to_file.write(chunk)
+
+        if digest is not None:
+            digest.update(chunk)
+
+        written += size
+
+    return written
+
 def copy_file(from_path, to_path):
-    with open(from_path) as from_file:
-        with open(to_path, 'w') as to_file:
-            CHUNK_SIZE = 128 # bytes
-            data = from_file.read(CHUNK_SIZE)
-            while data:
-                to_file.write(data)
-                data = from_file.read(CHUNK_SIZE)
+    # Binary mode, so compiled .mpy files survive the copy
+    with open(from_path, 'rb') as from_file:
+        with open(to_path, 'wb') as to_file:
+            write_stream(from_file, to_file)
+
+    gc_policy.between_phases()
+
+# Saves a response body to flash through the shared buffer, without holding the whole body in memory
+def save_stream(stream, to_path) -> int:
+    with open(to_path, 'wb') as to_file:
+        written = write_stream(stream, to_file)
+
+    gc_policy.between_phases()
+
+    return written
+
+def replace_file(from_path, to_path):
+    # Renaming over an existing file is atomic on LittleFS
+    try:
+        os.rename(from_path, to_path)
 
-            to_file.close()
+        return
 
-        del to_file
+    except OSError:
+        pass
 
-        from_file.close()
+    # FAT refuses to rename over an existing file
+    try:
+        os.remove(to_path)
 
-    del from_file
+    except OSError:
+        pass
 
-    gc.collect()
+    try:
+        os.rename(from_path, to_path)
 
-def json_dumps_with_indent(data, indent=4, nested_index=1) -> str:
+        return
+
+    except OSError:
+        pass
+
+    copy_file(from_path, to_path)
+    os.remove(from_path)
+
+# Looks a response header up by name, header names keep the case the server sent them in
+def get_header(headers: dict, name: str) -> str | None:
+    name = name.lower()
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+
+    return None
+
+# Writes JSON straight to an open file or socket piece by piece, so no string of the full output is ever built
+def json_dump_with_indent(data, stream, indent=4, nested_index=1):
     if not isinstance(data, dict) and not isinstance(data, list):
-        return json.dumps(data)
+        stream.write(json.dumps(data))
+
+        return
+
+    is_list = isinstance(data, list)
 
     if len(data) == 0:
-        return "{}" if isinstance(data, dict) else "[]"
+        stream.write("[]" if is_list else "{}")
 
-    output = ''
+        return
 
-    is_list = isinstance(data, list)
+    stream.write("[" if is_list else "{")
 
-    if isinstance(data, dict):
-        enumerated_data = data.items()
-    else:
+    if is_list:
         enumerated_data = enumerate(data)
+    else:
+        enumerated_data = data.items()
 
-    lines = []
-
+    is_first = True
     for key, value in enumerated_data:
-        indentation = ' ' * (indent * nested_index)
-        key_output = ''
+        if not is_first:
+            stream.write(',')
+
+        is_first = False
+
+        if indent:
+            stream.write('\n')
+            write_indentation(stream, indent * nested_index)
+
         if not is_list:
-            key_output = f'"{key}": '
+            stream.write(json.dumps(key))
+            stream.write(': ' if indent else ':')
+
+        json_dump_with_indent(value, stream, indent, nested_index + 1)
 
-        json_value = json.dumps(value)
+    if indent:
+        stream.write('\n')
+        write_indentation(stream, indent * (nested_index - 1))
 
-        if isinstance(value, dict) or isinstance(value, list):
-            json_value = json_dumps_with_indent(value, indent, nested_index + 1)
+    stream.write("]" if is_list else "}")
 
-        lines.append(indentation + key_output + json_value)
+INDENTATION = ' ' * 16
 
-    output = (',\n').join(lines)
+def write_indentation(stream, size: int):
+    while size > 0:
+        stream.write(INDENTATION[:size] if size < len(INDENTATION) else INDENTATION)
 
-    return "[\n" + output + "\n" + (' ' * ((nested_index - 1) * indent)) + "]" if is_list else "{\n" + output + "\n" + (' ' * ((nested_index - 1) * indent)) + "}"
+        size -= len(INDENTATION)
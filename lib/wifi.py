@@ -1,53 +1,42 @@
-import machine
 import network
-import ntptime
-import utime
 
+from lib.clock import clock
 from lib.config import Config
 from lib.logger import Logger
+from lib.phases import PHASE_WIFI_CONNECT
+from lib.recovery import recovery, SUBSYSTEM_WIFI
+from lib.trace import trace
+
+# The access point of the last connection, so a reconnect can skip the scan
+CACHE_KEY = 'wifi_access_point'
+
+POLL_INTERVAL_MS = 50
+CONNECT_TIMEOUT_MS = 10000
+DIRECT_CONNECT_TIMEOUT_MS = 5000
 
 class WifiHandler:
     debug: bool = False
     networks: dict[str, str] = {}
     logger: Logger
+    connect_ms: int | None = None
+    connected_directly: bool = False
 
     def __init__(self, config: Config, logger: Logger):
         self.debug = config.debug
         self.logger = logger
 
         self.networks = config.wifi_networks
+        self.connect_ms = None
+        self.connected_directly = False
 
         self.wlan = network.WLAN()
         self.wlan.active(True)
 
         self.do_connect()
 
-        self.logger.output('synchronizing time with NTP server...')
-
-        ntp_counter = 0
-        while True:
-            try:
-                ntptime.settime()
-
-                break
-
-            except OSError as e:
-                self.logger.output(f'OSError setting time: {e}')
-
-                machine.reset()
-
-            except Exception as e:
-                self.logger.output(f'Error setting time: {e}, retrying in 5 seconds...')
-
-                utime.sleep(5)
-
-            ntp_counter += 1
-            if ntp_counter >= 5:
-                self.logger.output('Failed to synchronize time after multiple attempts, proceeding without accurate time.')
-
-                machine.reset()
-
-        self.logger.output('current time:', utime.localtime())
+    def apply_config(self, config: Config):
+        self.debug = config.debug
+        self.networks = config.wifi_networks
 
     @property
     def mac_address(self) -> str:
@@ -64,62 +53,142 @@ class WifiHandler:
         if not self.wlan.isconnected():
             self.do_connect()
 
+    def reinitialize(self, attempt: int = 1):
+        self.logger.output('Reinitializing WLAN...')
+
+        try:
+            self.wlan.disconnect()
+
+        except OSError:
+            pass
+
+        self.wlan.active(False)
+
+        clock.sleep_ms(100)
+
+        self.wlan.active(True)
+
+        self.do_connect()
+
     def do_connect(self):
         self.logger.output('connecting to network...')
 
+        started_at = clock.ticks_ms()
+        trace_started_at = trace.begin()
+
+        # The access point from the last connection is tried without a scan, which takes seconds on its own
+        is_direct = self.connect_cached()
+
         while not self.wlan.isconnected():
+            recovery.feed()
+
             access_points = self.wlan.scan()
             access_points.sort(key=lambda x: x[3], reverse=True)
-            filtered_access_points = {
-                access_point[0]: access_point[3]
-                for access_point in access_points if access_point[0].decode('utf-8') in self.networks
-            }
+
+            # Strongest access point for each known network, as (bssid, channel, rssi)
+            filtered_access_points = {}
+            for access_point in access_points:
+                if access_point[0] not in filtered_access_points and access_point[0].decode('utf-8') in self.networks:
+                    filtered_access_points[access_point[0]] = (access_point[1], access_point[2], access_point[3])
 
             del access_points
 
             if len(filtered_access_points) == 0:
                 self.logger.output('No known access points found, retrying...')
 
-                utime.sleep(1)
+                clock.sleep(1)
 
                 continue
 
             self.logger.output(f'Found {len(filtered_access_points)} access points')
 
-            for ssid, rssi in filtered_access_points.items():
+            for ssid, (bssid, channel, rssi) in filtered_access_points.items():
                 ssid = ssid.decode('utf-8')
                 if self.networks.get(ssid) is None:
                     self.logger.output(f'No password for {ssid}, skipping.')
 
                     continue
 
-                try:
-                    self.logger.output(f'Connecting to {ssid} [RSSI: {rssi}]...')
+                self.logger.output(f'Connecting to {ssid} [RSSI: {rssi}]...')
 
-                    self.wlan.disconnect()
+                if self.connect_to(ssid, bssid, channel):
+                    break
 
-                    utime.sleep(1)
+            del filtered_access_points
 
-                    self.wlan.connect(ssid, self.networks[ssid])
-                    is_connected = self.wlan.isconnected()
-                    attempts = 0
+        self.connect_ms = clock.ticks_diff(clock.ticks_ms(), started_at)
+        self.connected_directly = is_direct
 
-                    while not is_connected and attempts < 10:
-                        utime.sleep(1)
-                        is_connected = self.wlan.isconnected()
-                        attempts += 1
+        trace.end(PHASE_WIFI_CONNECT, trace_started_at)
 
-                    if is_connected:
-                        break
+        self.logger.output(f'connected in {self.connect_ms}ms{" to the cached access point" if is_direct else ""}, network config:', self.wlan.ipconfig('addr4'))
 
-                except OSError as e:
-                    self.logger.output(f'OSError connecting to {ssid}: {e}')
+    def connect_cached(self) -> bool:
+        from lib.cache_store import cache_store
 
-                    machine.reset()
+        # Stored as [ssid, bssid hex, channel]
+        cached = cache_store.get(CACHE_KEY)
+        if cached is None or self.networks.get(cached[0]) is None:
+            return False
 
-                except Exception as e:
-                    self.logger.output(f'Error connecting to {ssid}: {e}')
+        ssid, bssid, channel = cached
 
-            del filtered_access_points
+        self.logger.output(f'Connecting to {ssid} on channel {channel}...')
+
+        if self.connect_to(ssid, bytes.fromhex(bssid), channel, timeout_ms=DIRECT_CONNECT_TIMEOUT_MS):
+            return True
+
+        self.logger.output(f'Could not connect to {ssid} directly, scanning...')
+
+        # The access point has moved or gone, forgetting it saves the direct connect timeout on every later reconnect
+        cache_store.set(CACHE_KEY, None)
+
+        return False
+
+    def connect_to(self, ssid: str, bssid: bytes, channel: int, timeout_ms: int = CONNECT_TIMEOUT_MS) -> bool:
+        from lib.cache_store import cache_store
+
+        try:
+            # Only an attempt still in progress needs cancelling, an idle interface connects straight away
+            if self.wlan.status() != network.STAT_IDLE:
+                self.wlan.disconnect()
+
+            try:
+                # Skips the channel scan the driver would otherwise do before connecting
+                self.wlan.config(channel=channel)
+
+            except (OSError, ValueError):
+                pass
+
+            self.wlan.connect(ssid, self.networks[ssid], bssid=bssid)
+
+            started_at = clock.ticks_ms()
+            while not self.wlan.isconnected():
+                if self.wlan.status() in (network.STAT_WRONG_PASSWORD, network.STAT_NO_AP_FOUND):
+                    break
+
+                if clock.ticks_diff(clock.ticks_ms(), started_at) > timeout_ms:
+                    break
+
+                clock.sleep_ms(POLL_INTERVAL_MS)
+
+            if not self.wlan.isconnected():
+                self.wlan.disconnect()
+
+                return False
+
+            recovery.success(SUBSYSTEM_WIFI)
+
+            cache_store.set(CACHE_KEY, [ssid, bssid.hex(), channel])
+
+            return True
+
+        except OSError as e:
+            self.logger.output(f'OSError connecting to {ssid}: {e}')
+
+            recovery.failure(SUBSYSTEM_WIFI, e)
+
+        except Exception as e:
+            self.logger.output(f'Error connecting to {ssid}: {e}')
 
-        self.logger.output('network config:', self.wlan.ipconfig('addr4'))
+        return False
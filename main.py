@@ -1,9 +1,19 @@
 # This file is executed on every boot
 
-import utime
-
 print('Starting...')
 
-utime.sleep(30)
+# Selects the release slot, so it has to run before anything is imported from lib
+from slot_state import slot_state
+
+slot_state.activate()
+
+from lib.fastboot import startup_delay
+
+startup_delay()
+
+try:
+    import base
+except Exception as e:
+    slot_state.boot_failed(e)
 
-import base
+    raise
@@ -0,0 +1,130 @@
+import os
+import sys
+import ujson as json
+
+# Releases are installed into one of two slot directories, the pointer in slot.json selects which one runs.
+# This module is imported by boot.py before anything from lib, so it must not import from lib itself.
+SLOT_FILE = 'slot.json'
+SLOTS = ('slot_a', 'slot_b')
+
+class SlotState:
+    data: dict = {}
+    is_activated: bool = False
+
+    def __init__(self):
+        self.data = {}
+        self.is_activated = False
+
+        self.load()
+
+    def load(self):
+        try:
+            with open(SLOT_FILE, 'r') as f:
+                self.data = json.load(f)
+
+        except Exception:
+            self.data = {}
+
+    def save(self):
+        tmp_path = SLOT_FILE + '.tmp'
+
+        with open(tmp_path, 'w') as f:
+            json.dump(self.data, f)
+
+        # Renaming over the pointer is atomic on LittleFS, FAT needs the old file removed first
+        try:
+            os.rename(tmp_path, SLOT_FILE)
+
+        except OSError:
+            os.remove(SLOT_FILE)
+            os.rename(tmp_path, SLOT_FILE)
+
+    @property
+    def active(self) -> str:
+        # An empty slot is the tree in the filesystem root, as flashed
+        return self.data.get('active', '')
+
+    @property
+    def inactive(self) -> str:
+        return SLOTS[1] if self.active == SLOTS[0] else SLOTS[0]
+
+    @property
+    def is_on_trial(self) -> bool:
+        return self.active != '' and not self.data.get('healthy', True)
+
+    def version(self, default: str) -> str:
+        return self.data.get('version') or default
+
+    def path(self, file_path: str) -> str:
+        return f'/{self.active}/{file_path}' if self.active else file_path
+
+    def activate(self):
+        # boot.py and main.py both call this, only the first call counts
+        if self.is_activated:
+            return
+
+        self.is_activated = True
+
+        if self.is_on_trial:
+            boots = self.data.get('boots', 0) + 1
+
+            if boots > self.data.get('max_boots', 3):
+                self.rollback()
+            else:
+                self.data['boots'] = boots
+
+                self.save()
+
+        if self.active:
+            print(f'Running {self.version("")} from /{self.active}')
+
+            sys.path.insert(0, f'/{self.active}/lib')
+            sys.path.insert(0, f'/{self.active}')
+
+    def rollback(self):
+        print(f'{self.active} was not marked healthy within {self.data.get("max_boots", 3)} boots, rolling back to /{self.data.get("previous", "")}')
+
+        self.data = {
+            'active': self.data.get('previous', ''),
+            'version': self.data.get('previous_version'),
+            'failed_version': self.data.get('version'),
+            'healthy': True,
+        }
+
+        self.save()
+
+    def switch(self, slot: str, version: str, previous_version: str, max_boots: int):
+        self.data = {
+            'active': slot,
+            'previous': self.active,
+            'version': version,
+            'previous_version': previous_version,
+            'failed_version': self.data.get('failed_version'),
+            'healthy': False,
+            'boots': 0,
+            'max_boots': max_boots,
+        }
+
+        self.save()
+
+    def mark_healthy(self):
+        if not self.is_on_trial:
+            return
+
+        print(f'Marking {self.version("")} in /{self.active} as healthy')
+
+        self.data['healthy'] = True
+        self.data['boots'] = 0
+
+        self.save()
+
+    def boot_failed(self, error):
+        # A release which cannot even start is retried by resetting, until the boot count triggers the rollback
+        if self.is_on_trial:
+            import machine
+
+            sys.print_exception(error)
+
+            machine.reset()
+
+slot_state = SlotState()
@@ -0,0 +1,141 @@
+# Runs the device code under CPython. The MicroPython modules it needs are replaced by stand-ins,
+# time itself comes from the simulated clock in lib/clock.py.
+import binascii
+import builtins
+import gc
+import json
+import os
+import sys
+import time
+import types
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# MicroPython does not evaluate annotations, CPython does, and "int | callable" is not a valid type there
+class AnnotatableCallable:
+    def __call__(self, value):
+        return builtins_callable(value)
+
+    def __or__(self, other):
+        return self
+
+    def __ror__(self, other):
+        return self
+
+builtins_callable = builtins.callable
+builtins.callable = AnnotatableCallable()
+
+gc.mem_alloc = lambda: 0
+gc.mem_free = lambda: 100000
+gc.threshold = lambda *args: None
+
+utime = types.ModuleType('utime')
+utime.ticks_ms = lambda: int(time.monotonic() * 1000)
+utime.ticks_us = lambda: int(time.monotonic() * 1000000)
+utime.ticks_add = lambda ticks, delta: ticks + delta
+utime.ticks_diff = lambda end, start: end - start
+utime.time = lambda: int(time.time())
+utime.localtime = lambda seconds=None: time.gmtime(seconds)
+utime.gmtime = lambda seconds=None: time.gmtime(seconds)
+utime.mktime = lambda tm: int(time.mktime(tuple(tm) + (0,) * (9 - len(tm))))
+utime.sleep = lambda seconds: None
+utime.sleep_ms = lambda delay_ms: None
+sys.modules['utime'] = utime
+
+class RTC:
+    stored = b''
+
+    def memory(self, data=None):
+        if data is None:
+            return RTC.stored
+
+        RTC.stored = data.encode() if isinstance(data, str) else data
+
+    def datetime(self, value=None):
+        pass
+
+machine = types.ModuleType('machine')
+machine.RTC = RTC
+machine.WDT_RESET = 3
+machine.HARD_RESET = 2
+machine.SOFT_RESET = 5
+machine.DEEPSLEEP_RESET = 4
+machine.reset_cause = lambda: machine.HARD_RESET
+machine.lightsleep = lambda delay_ms: None
+machine.deepsleep = lambda delay_ms: None
+machine.reset = lambda: None
+sys.modules['machine'] = machine
+
+micropython = types.ModuleType('micropython')
+micropython.const = lambda value: value
+sys.modules['micropython'] = micropython
+
+sys.modules['ujson'] = json
+sys.modules['ubinascii'] = binascii
+sys.modules['ntptime'] = types.ModuleType('ntptime')
+
+# Stand-ins for network.WLAN and bluetooth.BLE, recording what the arbiter did to them
+class StandInWLAN:
+    PM_NONE = 0
+    PM_PERFORMANCE = 1
+    PM_POWERSAVE = 2
+
+    def __init__(self, connected: bool = True):
+        self.pm = self.PM_PERFORMANCE
+        self.connected = connected
+
+    def config(self, pm):
+        self.pm = pm
+
+    def isconnected(self) -> bool:
+        return self.connected
+
+class StandInBLE:
+    def __init__(self):
+        self.scanning = False
+
+    def active(self) -> bool:
+        return True
+
+    def gap_scan(self, duration_ms, *args):
+        self.scanning = duration_ms is not None
+
+class StandInConfig:
+    radio_policy = 'windows'
+    radio_max_ble_window_seconds = 120
+    power_mode = 'awake'
+    power_min_light_sleep_ms = 1000
+    power_deep_sleep_start_hour = None
+    power_deep_sleep_end_hour = None
+
+    def __init__(self, **attributes):
+        for key, value in attributes.items():
+            setattr(self, key, value)
+
+@pytest.fixture
+def wlan():
+    return StandInWLAN()
+
+@pytest.fixture
+def ble():
+    return StandInBLE()
+
+@pytest.fixture
+def simulated_clock():
+    from lib.clock import clock
+    from lib.power import power
+    from lib.radio import radio
+
+    # Midnight on 2024-01-01, a Monday
+    clock.simulate(start_time=1704067200)
+
+    yield clock
+
+    clock.simulated = False
+
+    power.configure(StandInConfig())
+    power.handlers = []
+
+    radio.__init__()
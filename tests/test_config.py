@@ -0,0 +1,38 @@
+import shutil
+
+from lib.config import Config, CONFIG_HASH_FILE
+
+ROOT = __file__.rsplit('/tests/', 1)[0]
+
+def write_config(debug: bool):
+    # Same size either way, so only the content tells them apart
+    with open('config.json', 'w') as f:
+        f.write('{"debug": true }' if debug else '{"debug": false}')
+
+def test_snapshot_follows_a_config_written_with_its_hash(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    shutil.copy(f'{ROOT}/config.default.json', 'config.default.json')
+
+    write_config(False)
+    Config.save_hash('config.json')
+
+    assert Config.from_json_file('config.json').debug is False
+
+    Config.clear_hash()
+    write_config(True)
+    Config.save_hash('config.json')
+
+    assert Config.from_json_file('config.json').debug is True
+
+def test_config_without_a_hash_is_hashed_at_boot(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    shutil.copy(f'{ROOT}/config.default.json', 'config.default.json')
+
+    write_config(False)
+
+    assert Config.from_json_file('config.json').debug is False
+
+    write_config(True)
+
+    assert Config.from_json_file('config.json').debug is True
+    assert not (tmp_path / CONFIG_HASH_FILE).exists()
@@ -0,0 +1,24 @@
+from lib.log_ring import LogRing, MESSAGE_SIZE
+
+def test_messages_are_cut_on_a_character_boundary(tmp_path):
+    log_ring = LogRing(str(tmp_path / 'log.bin'), slots=8, buffer_size=8)
+
+    log_ring.append(30, 'x' * (MESSAGE_SIZE - 1) + 'é')
+    log_ring.append(30, 'x' * (MESSAGE_SIZE - 2) + '€')
+    log_ring.append(30, 'é' * MESSAGE_SIZE)
+
+    messages = [message.decode() for _, _, _, message in log_ring.entries_after(0, 8)]
+
+    assert messages == ['x' * (MESSAGE_SIZE - 1), 'x' * (MESSAGE_SIZE - 2), 'é' * (MESSAGE_SIZE // 2)]
+
+def test_records_cut_mid_character_still_decode(tmp_path):
+    log_ring = LogRing(str(tmp_path / 'log.bin'), slots=8, buffer_size=8)
+
+    # As written before messages were cut on a character boundary
+    log_ring.append(30, 'ok')
+    log_ring.buffer[0][9] = 3
+    log_ring.buffer[0][10:13] = 'ok'.encode() + 'é'.encode()[:1]
+
+    [(_, _, _, message)] = log_ring.entries_after(0, 8)
+
+    assert message.decode() == 'ok'
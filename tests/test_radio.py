@@ -0,0 +1,119 @@
+from conftest import StandInConfig, StandInWLAN
+
+from lib.radio import RadioArbiter, RADIO_BLE, RADIO_WIFI, POLICY_SHARED, POLICY_WINDOWS, BLE_CONNECTS, BLE_FAILURES, HTTP_REQUESTS, HTTP_MS_MAX
+
+def test_windows_policy_holds_wifi_back_during_bluetooth(simulated_clock, wlan, ble):
+    arbiter = RadioArbiter(wlan, ble, policy=POLICY_WINDOWS)
+
+    arbiter.begin_ble()
+
+    assert not arbiter.allows(RADIO_WIFI)
+    assert arbiter.allows(RADIO_BLE)
+    assert arbiter.allows(None)
+    assert wlan.pm == wlan.PM_POWERSAVE
+
+    ble.scanning = True
+
+    arbiter.end_ble()
+
+    assert arbiter.allows(RADIO_WIFI)
+    assert wlan.pm == wlan.PM_PERFORMANCE
+    assert not ble.scanning
+
+def test_shared_policy_leaves_the_radios_alone(simulated_clock, wlan, ble):
+    arbiter = RadioArbiter(wlan, ble, policy=POLICY_SHARED)
+
+    ble.scanning = True
+
+    arbiter.begin_ble()
+
+    assert arbiter.allows(RADIO_WIFI)
+    assert wlan.pm == wlan.PM_PERFORMANCE
+
+    arbiter.end_ble()
+
+    assert ble.scanning
+
+def test_unfinished_window_expires(simulated_clock, wlan, ble):
+    arbiter = RadioArbiter(wlan, ble, policy=POLICY_WINDOWS, max_ble_window_ms=5000)
+
+    arbiter.begin_ble()
+    simulated_clock.advance(4000)
+
+    assert not arbiter.allows(RADIO_WIFI)
+
+    simulated_clock.advance(2000)
+
+    assert arbiter.allows(RADIO_WIFI)
+    assert arbiter.window is None
+    assert wlan.pm == wlan.PM_PERFORMANCE
+
+def test_switching_to_shared_during_a_window_releases_wifi(simulated_clock, wlan, ble):
+    arbiter = RadioArbiter(wlan, ble, policy=POLICY_WINDOWS)
+
+    arbiter.begin_ble()
+    arbiter.configure(StandInConfig(radio_policy=POLICY_SHARED))
+
+    assert arbiter.allows(RADIO_WIFI)
+    assert wlan.pm == wlan.PM_PERFORMANCE
+
+    # The window closes under the new policy without touching WiFi again
+    wlan.pm = None
+    arbiter.end_ble()
+
+    assert wlan.pm is None
+
+def test_switching_to_windows_during_a_window_applies_power_save(simulated_clock, wlan, ble):
+    arbiter = RadioArbiter(wlan, ble, policy=POLICY_SHARED)
+
+    arbiter.begin_ble()
+    arbiter.configure(StandInConfig(radio_policy=POLICY_WINDOWS))
+
+    assert not arbiter.allows(RADIO_WIFI)
+    assert wlan.pm == wlan.PM_POWERSAVE
+
+    arbiter.end_ble()
+
+    assert arbiter.allows(RADIO_WIFI)
+    assert wlan.pm == wlan.PM_PERFORMANCE
+
+def test_unknown_policy_falls_back_to_windows(simulated_clock, wlan, ble):
+    arbiter = RadioArbiter(wlan, ble, policy=POLICY_SHARED)
+
+    arbiter.configure(StandInConfig(radio_policy='exclusive'))
+
+    assert arbiter.policy == POLICY_WINDOWS
+
+def test_metrics_are_kept_per_policy(simulated_clock, wlan, ble):
+    arbiter = RadioArbiter(wlan, ble, policy=POLICY_SHARED)
+
+    arbiter.ble_connect(True)
+    arbiter.ble_connect(False)
+    arbiter.http_request(120, True)
+
+    arbiter.configure(StandInConfig(radio_policy=POLICY_WINDOWS))
+
+    arbiter.http_request(80, False)
+
+    shared = arbiter.summary()[POLICY_SHARED]
+    windows = arbiter.summary()[POLICY_WINDOWS]
+
+    assert shared[BLE_CONNECTS] == 2 and shared[BLE_FAILURES] == 1
+    assert shared[HTTP_REQUESTS] == 1 and shared[HTTP_MS_MAX] == 120
+    assert windows[BLE_CONNECTS] == 0 and windows[HTTP_REQUESTS] == 1
+
+def test_prepare_reconnects_wifi_for_wifi_tasks_only(simulated_clock, ble):
+    wlan = StandInWLAN(connected=False)
+    connects = []
+
+    arbiter = RadioArbiter(policy=POLICY_WINDOWS)
+    arbiter.attach(wlan, ble, lambda: connects.append(True))
+
+    arbiter.prepare(RADIO_BLE)
+    arbiter.prepare(None)
+
+    assert connects == []
+
+    arbiter.prepare(RADIO_WIFI)
+
+    assert connects == [True]
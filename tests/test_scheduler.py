@@ -0,0 +1,128 @@
+from conftest import StandInConfig
+
+from lib.logger import logger
+from lib.power import power
+from lib.radio import radio, RADIO_BLE, RADIO_WIFI
+from lib.recovery import recovery
+from lib.rtc_state import rtc_state
+from lib.scheduler import Scheduler
+
+HOUR_MS = 3600 * 1000
+
+def test_tasks_run_on_their_intervals(simulated_clock):
+    scheduler = Scheduler(logger)
+
+    runs = {'fast': [], 'slow': []}
+    scheduler.schedule('fast', lambda task: runs['fast'].append(simulated_clock.time()), interval=10)
+    scheduler.schedule('slow', lambda task: runs['slow'].append(simulated_clock.time()), interval=60, delay=60)
+
+    scheduler.run(duration_ms=HOUR_MS)
+
+    assert len(runs['fast']) == 360
+    assert len(runs['slow']) == 59
+    assert all(b - a == 10 for a, b in zip(runs['fast'], runs['fast'][1:]))
+
+    # A full hour has passed on the simulated clock, and only by sleeping
+    assert simulated_clock.now_ms >= HOUR_MS
+    assert simulated_clock.slept_ms > HOUR_MS * 0.99
+
+def test_a_task_can_run_itself_again_sooner(simulated_clock):
+    scheduler = Scheduler(logger)
+
+    runs = []
+    def slice(task):
+        runs.append(simulated_clock.time())
+        if len(runs) < 3:
+            task.run_in(1)
+
+    scheduler.schedule('sliced', slice, interval=600)
+
+    scheduler.run(duration_ms=10 * 1000)
+
+    assert [t - runs[0] for t in runs] == [0, 1, 2]
+
+def test_light_sleep_between_tasks(simulated_clock):
+    power.configure(StandInConfig(power_mode='light', power_min_light_sleep_ms=5000))
+
+    scheduler = Scheduler(logger)
+    scheduler.schedule('sample', lambda task: None, interval=10)
+
+    scheduler.run(duration_ms=60 * 1000)
+
+    assert simulated_clock.light_sleeps == 6
+
+    # Gaps shorter than the minimum are waited out awake
+    power.configure(StandInConfig(power_mode='light', power_min_light_sleep_ms=20000))
+
+    scheduler.run(duration_ms=60 * 1000)
+
+    assert simulated_clock.light_sleeps == 6
+
+def test_deep_sleep_through_the_night(simulated_clock):
+    # 21:00 UTC
+    simulated_clock.advance(21 * HOUR_MS)
+
+    power.configure(StandInConfig(power_deep_sleep_start_hour=22, power_deep_sleep_end_hour=6))
+
+    saved = []
+    power.before_deep_sleep(lambda: rtc_state.set('carry', {'cursor': 1}))
+    power.before_deep_sleep(lambda: saved.append(simulated_clock.localtime()[3]))
+
+    runs = []
+    def check_deep_sleep(task):
+        seconds = power.deep_sleep_seconds()
+        if seconds > 0:
+            power.deep_sleep(seconds)
+
+    scheduler = Scheduler(logger)
+    scheduler.schedule('sample', lambda task: runs.append(simulated_clock.localtime()[3:5]), interval=600)
+    scheduler.schedule('deep_sleep', check_deep_sleep, interval=60, delay=60)
+
+    scheduler.run(duration_ms=12 * HOUR_MS)
+
+    assert simulated_clock.deep_sleeps == 1
+    assert saved == [22]
+    assert rtc_state.get('carry') == {'cursor': 1}
+
+    # Nothing ran between going to sleep at 22:00 and waking at 6:00
+    assert not any(tm > (22, 0) or tm < (6, 0) for tm in runs)
+    assert (6, 0) in runs
+    assert simulated_clock.localtime()[3] == 9
+
+def test_wifi_tasks_wait_for_a_bluetooth_sweep(simulated_clock, wlan, ble):
+    radio.attach(wlan, ble)
+    radio.configure(StandInConfig(radio_policy='windows'))
+
+    order = []
+    def sweep(task):
+        radio.begin_ble()
+        order.append('ble')
+
+        # The sweep takes three slices, a second apart
+        if order.count('ble') < 3:
+            task.run_in(1)
+        else:
+            radio.end_ble()
+
+    scheduler = Scheduler(logger)
+    scheduler.schedule('bluetooth_poll', sweep, interval=600, radio=RADIO_BLE)
+    scheduler.schedule('upload', lambda task: order.append('upload'), interval=600, radio=RADIO_WIFI)
+
+    scheduler.run(duration_ms=10 * 1000)
+
+    assert order == ['ble', 'ble', 'ble', 'upload']
+
+def test_recovery_backoff_uses_the_simulated_clock(simulated_clock):
+    attempts = []
+    def failing_request():
+        attempts.append(simulated_clock.now_ms)
+        if len(attempts) < 3:
+            raise OSError(-1)
+
+        return 'ok'
+
+    recovery.retries = 2
+    recovery.backoff_ms = 500
+
+    assert recovery.call('test', failing_request) == 'ok'
+    assert [t - attempts[0] for t in attempts] == [0, 500, 1500]
@@ -0,0 +1,96 @@
+# Compares install times for a full release tree on the device, run it with:
+#
+#   mpremote run tools/bench_install.py
+#
+# The release is simulated by staging a copy of the installed lib/ tree and base.py in bench_next/,
+# which is then installed into bench_live/ with the old 128-byte text copy, the buffered binary copy,
+# and the rename-based replace.
+
+import os
+import utime
+
+from lib.utils import copy_file, replace_file
+
+STAGING_DIR = 'bench_next'
+LIVE_DIR = 'bench_live'
+
+def legacy_copy_file(from_path, to_path):
+    with open(from_path) as from_file:
+        with open(to_path, 'w') as to_file:
+            data = from_file.read(128)
+            while data:
+                to_file.write(data)
+                data = from_file.read(128)
+
+def list_files(path, prefix=''):
+    files = []
+    for entry in os.ilistdir(path):
+        relative_path = prefix + entry[0]
+        if entry[1] == 0x4000:
+            files.extend(list_files(path + '/' + entry[0], relative_path + '/'))
+        else:
+            files.append(relative_path)
+
+    return files
+
+def make_dirs(root, files):
+    for file_path in files:
+        parts = file_path.split('/')[:-1]
+        path = root
+        for part in parts:
+            path += '/' + part
+            try:
+                os.mkdir(path)
+            except OSError:
+                pass
+
+def remove_tree(path):
+    try:
+        entries = list(os.ilistdir(path))
+    except OSError:
+        return
+
+    for entry in entries:
+        if entry[1] == 0x4000:
+            remove_tree(path + '/' + entry[0])
+        else:
+            os.remove(path + '/' + entry[0])
+
+    os.rmdir(path)
+
+def stage(files):
+    remove_tree(STAGING_DIR)
+    os.mkdir(STAGING_DIR)
+    make_dirs(STAGING_DIR, files)
+
+    for file_path in files:
+        copy_file(file_path, STAGING_DIR + '/' + file_path)
+
+def install(files, install_file) -> int:
+    remove_tree(LIVE_DIR)
+    os.mkdir(LIVE_DIR)
+    make_dirs(LIVE_DIR, files)
+
+    # Every file already exists in the live tree, as it would on a real device
+    for file_path in files:
+        copy_file(file_path, LIVE_DIR + '/' + file_path)
+
+    start = utime.ticks_ms()
+
+    for file_path in files:
+        install_file(STAGING_DIR + '/' + file_path, LIVE_DIR + '/' + file_path)
+
+    return utime.ticks_diff(utime.ticks_ms(), start)
+
+files = ['base.py'] + ['lib/' + file_path for file_path in list_files('lib')]
+total_bytes = sum(os.stat(file_path)[6] for file_path in files)
+
+print(f'Release tree: {len(files)} files, {total_bytes} bytes')
+
+for name, install_file in (('legacy text copy', legacy_copy_file), ('binary copy', copy_file), ('rename', replace_file)):
+    stage(files)
+
+    print(name, install(files, install_file), 'ms', sep='\t')
+
+remove_tree(STAGING_DIR)
+remove_tree(LIVE_DIR)
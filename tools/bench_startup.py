@@ -0,0 +1,44 @@
+# Measures import time and heap usage of the main modules on the device, run it against each build with:
+#
+#   mpremote run tools/bench_startup.py
+
+import gc
+import utime
+
+MODULES = (
+    'lib.config',
+    'lib.logger',
+    'lib.recovery',
+    'lib.scheduler',
+    'lib.wifi',
+    'lib.sensor',
+    'lib.bluetooth_device.bluetooth_state',
+    'lib.monitor',
+    'lib.sensor_updater',
+)
+
+gc.collect()
+
+start_free = gc.mem_free()
+start_ticks = utime.ticks_ms()
+
+print('module', 'ms', 'heap_used', sep='\t')
+
+for module in MODULES:
+    gc.collect()
+
+    free = gc.mem_free()
+    ticks = utime.ticks_ms()
+
+    __import__(module)
+
+    elapsed_ms = utime.ticks_diff(utime.ticks_ms(), ticks)
+
+    gc.collect()
+
+    print(module, elapsed_ms, free - gc.mem_free(), sep='\t')
+
+gc.collect()
+
+print('total', utime.ticks_diff(utime.ticks_ms(), start_ticks), start_free - gc.mem_free(), sep='\t')
+print('mem_free', gc.mem_free(), sep='\t')
@@ -0,0 +1,70 @@
+# Cross-compiles the device tree to .mpy files, run on the host:
+#
+#   python tools/build_mpy.py --out dist
+#
+# boot.py and main.py are kept as source since MicroPython only runs them as .py files.
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SOURCE_ONLY_FILES = ('boot.py', 'main.py')
+COPIED_FILES = ('config.default.json',)
+SKIPPED_DIRS = ('tools', 'dist', 'build', 'slot_a', 'slot_b', '__pycache__')
+
+def iter_modules(root_dir: str):
+    for path in ('base.py', 'slot_state.py'):
+        yield path
+
+    for top_dir in ('lib', 'thirdparty'):
+        for dir_path, dir_names, file_names in os.walk(os.path.join(root_dir, top_dir)):
+            dir_names[:] = [name for name in dir_names if not name.startswith('.') and name not in SKIPPED_DIRS]
+
+            for file_name in file_names:
+                if file_name.endswith('.py') and not file_name.startswith('.'):
+                    yield os.path.relpath(os.path.join(dir_path, file_name), root_dir)
+
+def build(out_dir: str, mpy_cross: str, march: str | None):
+    if os.path.exists(out_dir):
+        shutil.rmtree(out_dir)
+
+    for path in iter_modules(ROOT_DIR):
+        target_path = os.path.join(out_dir, path[:-3] + '.mpy')
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+
+        command = [mpy_cross, '-o', target_path, '-s', path]
+        if march:
+            command.append(f'-march={march}')
+
+        command.append(path)
+
+        subprocess.run(command, cwd=ROOT_DIR, check=True)
+
+        print(f'{path} -> {os.path.relpath(target_path, ROOT_DIR)}')
+
+    for path in SOURCE_ONLY_FILES + COPIED_FILES:
+        shutil.copyfile(os.path.join(ROOT_DIR, path), os.path.join(out_dir, path))
+
+        print(f'{path} -> {os.path.relpath(os.path.join(out_dir, path), ROOT_DIR)}')
+
+def main():
+    parser = argparse.ArgumentParser(description='Cross-compile the device tree to .mpy files')
+    parser.add_argument('--out', default=os.path.join(ROOT_DIR, 'dist'), help='Output directory')
+    parser.add_argument('--mpy-cross', default='mpy-cross', help='Path to the mpy-cross binary matching the device firmware')
+    parser.add_argument('--march', default=None, help='Target architecture, only needed for native code (e.g. rv32imc for the ESP32-C3)')
+    args = parser.parse_args()
+
+    try:
+        build(os.path.abspath(args.out), args.mpy_cross, args.march)
+
+    except FileNotFoundError:
+        print(f'{args.mpy_cross} not found, install it with "pip install mpy-cross" or build it from the MicroPython repository.')
+
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,13 @@
+# Frozen-firmware manifest. Build the firmware from the MicroPython ports/esp32 directory with:
+#
+#   make BOARD=ESP32_GENERIC_C3 FROZEN_MANIFEST=/path/to/esp32-solar-sensor/tools/manifest.py
+#
+# Files on the filesystem are searched before frozen modules, so OTA updates still override the frozen copies.
+
+include("$(PORT_DIR)/boards/manifest.py")
+
+module("base.py", base_path="..")
+module("slot_state.py", base_path="..")
+
+package("lib", base_path="..")
+package("thirdparty", base_path="..")